@@ -1,5 +1,6 @@
 import glob
 import os
+import threading
 from abc import ABC, abstractmethod
 
 import yaml
@@ -8,6 +9,9 @@ from langchain_core.messages.ai import AIMessage
 
 
 class WorkflowHandler(ABC):
+    # Responses may be generated from worker threads, so cost updates are serialized
+    _cost_lock = threading.Lock()
+
     def __init__(self):
         self.total_cost = 0.0
 
@@ -24,7 +28,8 @@ class WorkflowHandler(ABC):
         raise NotImplementedError
 
     def _update_total_cost(self, response_meta):
-        self.total_cost += response_meta.total_cost
+        with self._cost_lock:
+            self.total_cost += response_meta.total_cost
 
     def _get_db_connection(self, db_server, db_name, db_user, db_password):
         """
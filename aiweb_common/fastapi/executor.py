@@ -0,0 +1,195 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+THREAD_TIER = "thread"
+PROCESS_TIER = "process"
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def _timed_call(func, args, kwargs):
+    # Runs inside the worker; the timestamps give the caller queue wait and run time
+    started = time.monotonic()
+    try:
+        result, error = func(*args, **kwargs), None
+    except Exception as e:
+        result, error = None, e
+    return started, time.monotonic(), result, error
+
+
+class ExecutorMetrics:
+    """
+    The `ExecutorMetrics` class keeps per-operation counts and timings of the tasks run by a
+    `TieredExecutor`: how many completed, failed, timed out (the caller stopped waiting) or were
+    rejected because the queue was full, and the total and maximum queue wait and run time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations = {}
+
+    def record(self, name, outcome, queue_wait=None, run_time=None):
+        with self._lock:
+            stats = self._operations.setdefault(
+                name,
+                {
+                    "completed": 0,
+                    "failed": 0,
+                    "timed_out": 0,
+                    "rejected": 0,
+                    "queue_wait_seconds": 0.0,
+                    "max_queue_wait_seconds": 0.0,
+                    "run_seconds": 0.0,
+                    "max_run_seconds": 0.0,
+                },
+            )
+            stats[outcome] += 1
+            if queue_wait is not None:
+                stats["queue_wait_seconds"] += queue_wait
+                stats["max_queue_wait_seconds"] = max(stats["max_queue_wait_seconds"], queue_wait)
+            if run_time is not None:
+                stats["run_seconds"] += run_time
+                stats["max_run_seconds"] = max(stats["max_run_seconds"], run_time)
+
+    def snapshot(self):
+        """Returns a copy of the metrics, keyed by operation name."""
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._operations.items()}
+
+
+class TieredExecutor:
+    """
+    The `TieredExecutor` class runs blocking work (Excel parsing, python-docx, pypandoc) off the
+    event loop of an async FastAPI handler. I/O-bound and GIL-releasing work goes to the thread
+    tier. CPU-bound work goes to the process tier, so it does not hold the GIL for the other
+    requests; its function and arguments must be picklable.
+
+    Each tier accepts at most its worker count plus `max_queue` tasks at a time. Further tasks are
+    rejected with a 503 instead of piling up, and callers that wait longer than their timeout get
+    a 504. A task that is already running cannot be interrupted, so it still finishes in the
+    background and keeps its slot until it does.
+    """
+
+    def __init__(self, thread_workers=8, process_workers=2, max_queue=32, default_timeout=None):
+        """
+        Args:
+            thread_workers: Number of threads in the thread tier.
+            process_workers: Number of processes in the process tier, started on first use.
+            max_queue: Number of tasks per tier allowed to wait for a free worker.
+            default_timeout: Seconds a caller waits for a task when `run` gets no timeout; None
+                waits indefinitely.
+        """
+        self.default_timeout = default_timeout
+        self.metrics = ExecutorMetrics()
+        self._workers = {THREAD_TIER: thread_workers, PROCESS_TIER: process_workers}
+        self._capacity = {tier: workers + max_queue for tier, workers in self._workers.items()}
+        self._in_flight = {THREAD_TIER: 0, PROCESS_TIER: 0}
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _pool(self, tier):
+        with self._lock:
+            if tier not in self._pools:
+                pool_class = ThreadPoolExecutor if tier == THREAD_TIER else ProcessPoolExecutor
+                self._pools[tier] = pool_class(max_workers=self._workers[tier])
+            return self._pools[tier]
+
+    def _reserve(self, tier):
+        with self._lock:
+            if self._in_flight[tier] >= self._capacity[tier]:
+                return False
+            self._in_flight[tier] += 1
+            return True
+
+    def _release(self, tier):
+        with self._lock:
+            self._in_flight[tier] -= 1
+
+    def _claim_outcome(self, future):
+        # The worker and a caller that times out race to report a task; only the first one counts
+        with self._lock:
+            if getattr(future, "_outcome_recorded", False):
+                return False
+            future._outcome_recorded = True
+            return True
+
+    def _task_done(self, tier, name, submitted, future):
+        self._release(tier)
+        if future.cancelled() or not self._claim_outcome(future):
+            return
+        if future.exception() is not None:
+            self.metrics.record(name, "failed")
+            return
+        started, finished, _, error = future.result()
+        self.metrics.record(
+            name,
+            "completed" if error is None else "failed",
+            queue_wait=started - submitted,
+            run_time=finished - started,
+        )
+
+    def queue_depth(self):
+        """Returns the number of tasks running or waiting in each tier."""
+        with self._lock:
+            return dict(self._in_flight)
+
+    async def run(self, func, *args, tier=THREAD_TIER, timeout=None, name=None, **kwargs):
+        """
+        The function `run` runs `func(*args, **kwargs)` in the given tier and awaits its result.
+
+        Args:
+          func: The blocking function to run.
+          tier: `THREAD_TIER` or `PROCESS_TIER`.
+          timeout: Seconds to wait for the result; defaults to `default_timeout`.
+          name: Operation name used in the metrics; defaults to the function name.
+
+        Returns:
+          The return value of `func`. Exceptions raised by `func` are re-raised. A full queue
+        raises a HTTPException with status code 503, and a timeout one with status code 504.
+        """
+        name = name or getattr(func, "__name__", repr(func))
+        timeout = self.default_timeout if timeout is None else timeout
+        if not self._reserve(tier):
+            self.metrics.record(name, "rejected")
+            raise HTTPException(status_code=503, detail="Server is busy, please try again later.")
+        submitted = time.monotonic()
+        try:
+            future = self._pool(tier).submit(_timed_call, func, args, kwargs)
+        except Exception:
+            self._release(tier)
+            raise
+        future.add_done_callback(lambda done: self._task_done(tier, name, submitted, done))
+
+        try:
+            _, _, result, error = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            if self._claim_outcome(future):
+                self.metrics.record(name, "timed_out")
+                raise HTTPException(
+                    status_code=504, detail=f"{name} did not finish within {timeout} seconds."
+                )
+            # The task finished (and was counted) just as the caller gave up, so use its result
+            _, _, result, error = future.result()
+        if error is not None:
+            raise error
+        return result
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for pool in pools.values():
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+
+def get_default_executor():
+    """Returns the process-wide `TieredExecutor`, creating it on first use."""
+    global _default_executor
+    with _default_executor_lock:
+        if _default_executor is None:
+            _default_executor = TieredExecutor()
+        return _default_executor
@@ -1,57 +1,283 @@
-import base64
-import os
-import tempfile
+import time
+from bisect import bisect_left
+from itertools import chain
 
-from fastapi import APIRouter, BackgroundTasks, File, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
+from aiweb_common.fastapi.executor import get_default_executor
+from aiweb_common.fastapi.responses import DEFAULT_CHUNK_SIZE
 from aiweb_common.fastapi.schemas import DecodeRequest
+from aiweb_common.file_operations.file_handling import (
+    iter_base64_decode,
+    iter_base64_encode,
+)
 
 # TODO are the other classes with just type definitions to move here?
 
 router = APIRouter(tags=["private"])
 
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Route label of requests that did not match any route, so unknown paths do not add series
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{_label_value(value)}"' for name, value in labels.items())
+
+
+class RequestMetrics:
+    """
+    The `RequestMetrics` class holds the per-route request metrics collected by
+    `MetricsMiddleware`: a latency histogram, request and response byte counts, responses by
+    status code and errors (5xx responses and unhandled exceptions), plus the number of requests
+    in flight and its peak.
+
+    Updates only happen on the event loop thread, between two awaits, so they need no locks;
+    `render` copies the counters before formatting them.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._routes = {}
+
+    def _route(self, method, route):
+        key = (method, route)
+        stats = self._routes.get(key)
+        if stats is None:
+            stats = self._routes[key] = {
+                # One count per bucket plus +Inf; made cumulative when rendered
+                "buckets": [0] * (len(self.buckets) + 1),
+                "latency_seconds": 0.0,
+                "requests": 0,
+                "errors": 0,
+                "request_bytes": 0,
+                "response_bytes": 0,
+                "statuses": {},
+            }
+        return stats
+
+    def request_started(self):
+        self.in_flight += 1
+        if self.in_flight > self.max_in_flight:
+            self.max_in_flight = self.in_flight
+
+    def request_finished(self, method, route, status, latency, request_bytes, response_bytes):
+        self.in_flight -= 1
+        stats = self._route(method, route)
+        stats["buckets"][bisect_left(self.buckets, latency)] += 1
+        stats["latency_seconds"] += latency
+        stats["requests"] += 1
+        stats["request_bytes"] += request_bytes
+        stats["response_bytes"] += response_bytes
+        stats["statuses"][status] = stats["statuses"].get(status, 0) + 1
+        if status >= 500:
+            stats["errors"] += 1
+
+    def snapshot(self):
+        """Returns a copy of the metrics, keyed by (method, route)."""
+        return {
+            key: {**stats, "buckets": list(stats["buckets"]), "statuses": dict(stats["statuses"])}
+            for key, stats in list(self._routes.items())
+        }
+
+    def render(self, executor=None):
+        """
+        Returns the metrics in the Prometheus text exposition format. When `executor` (a
+        `TieredExecutor`) is given, its queue depth and per-operation metrics are included too.
+        """
+        routes = sorted(self.snapshot().items())
+        lines = [
+            "# HELP http_requests_in_flight Requests currently being handled.",
+            "# TYPE http_requests_in_flight gauge",
+            f"http_requests_in_flight {self.in_flight}",
+            "# HELP http_requests_in_flight_max Peak of concurrent requests since startup.",
+            "# TYPE http_requests_in_flight_max gauge",
+            f"http_requests_in_flight_max {self.max_in_flight}",
+            "# HELP http_request_duration_seconds Request latency by route.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), stats in routes:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), stats["buckets"]):
+                cumulative += count
+                labels = _labels(method=method, route=route, le=bound)
+                lines.append(f"http_request_duration_seconds_bucket{{{labels}}} {cumulative}")
+            labels = _labels(method=method, route=route)
+            lines.append(
+                f"http_request_duration_seconds_sum{{{labels}}} {stats['latency_seconds']}"
+            )
+            lines.append(f"http_request_duration_seconds_count{{{labels}}} {stats['requests']}")
+
+        lines += [
+            "# HELP http_requests_total Responses by route and status code.",
+            "# TYPE http_requests_total counter",
+        ]
+        for (method, route), stats in routes:
+            for status, count in sorted(stats["statuses"].items()):
+                labels = _labels(method=method, route=route, status=status)
+                lines.append(f"http_requests_total{{{labels}}} {count}")
+
+        for name, field, help_text in (
+            ("http_request_errors_total", "errors", "5xx responses and unhandled exceptions."),
+            ("http_request_size_bytes_total", "request_bytes", "Request body bytes received."),
+            ("http_response_size_bytes_total", "response_bytes", "Response body bytes sent."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (method, route), stats in routes:
+                lines.append(f"{name}{{{_labels(method=method, route=route)}}} {stats[field]}")
+
+        if executor is not None:
+            lines += [
+                "# HELP executor_queue_depth Tasks running or waiting in each executor tier.",
+                "# TYPE executor_queue_depth gauge",
+            ]
+            for tier, depth in sorted(executor.queue_depth().items()):
+                lines.append(f"executor_queue_depth{{{_labels(tier=tier)}}} {depth}")
+            operations = sorted(executor.metrics.snapshot().items())
+            lines += [
+                "# HELP executor_tasks_total Executor tasks by operation and outcome.",
+                "# TYPE executor_tasks_total counter",
+            ]
+            for operation, stats in operations:
+                for outcome in ("completed", "failed", "timed_out", "rejected"):
+                    labels = _labels(operation=operation, outcome=outcome)
+                    lines.append(f"executor_tasks_total{{{labels}}} {stats[outcome]}")
+            for field in ("queue_wait_seconds", "run_seconds"):
+                name = f"executor_{field}_total"
+                lines += [f"# TYPE {name} counter"]
+                for operation, stats in operations:
+                    lines.append(f"{name}{{{_labels(operation=operation)}}} {stats[field]}")
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
+
+
+class MetricsMiddleware:
+    """
+    The `MetricsMiddleware` class is a pure ASGI middleware recording every HTTP request in a
+    `RequestMetrics` (by default the module-wide `request_metrics` served by `/internal/metrics`).
+    Requests are labelled with the path template of the route they matched (e.g.
+    "/items/{item_id}") rather than the raw path. Streaming responses are counted as they are
+    sent, without buffering them.
+
+    Add it with `app.add_middleware(MetricsMiddleware)` and include `router` for the endpoint.
+    """
+
+    def __init__(self, app, metrics=None):
+        self.app = app
+        self.metrics = request_metrics if metrics is None else metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.metrics
+        counts = {"status": 500, "request_bytes": 0, "response_bytes": 0}
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                counts["request_bytes"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.start":
+                counts["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                counts["response_bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        metrics.request_started()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        except Exception:
+            counts["status"] = 500
+            raise
+        finally:
+            # The router stores the matched route in the scope
+            route = getattr(scope.get("route"), "path", UNMATCHED_ROUTE)
+            metrics.request_finished(
+                scope["method"],
+                route,
+                counts["status"],
+                time.perf_counter() - started,
+                counts["request_bytes"],
+                counts["response_bytes"],
+            )
+
+
+def _iter_upload(file, chunk_size=DEFAULT_CHUNK_SIZE):
+    # Sync reads of the spooled upload; StreamingResponse runs sync iterators in a threadpool
+    file.seek(0)
+    while chunk := file.read(chunk_size):
+        yield chunk
+
 
 @router.post("/internal/convert-to-base64/", include_in_schema=True)
 async def convert_file_to_base64(file: UploadFile = File(...)):
     """
     Internal API endpoint to convert files to base64-encoded strings.
     This endpoint is intended for use by API developers for testing.
+
+    The upload is read and encoded in fixed-size chunks that are streamed straight into the
+    `{"base64": ...}` JSON body, so memory per request does not grow with the file size.
     """
     try:
-        # Convert the uploaded file to base64
-        content = await file.read()
-        encoded_string = base64.b64encode(content).decode("utf-8")
-        return {"base64": encoded_string}
+        encoded_chunks = iter_base64_encode(_iter_upload(file.file))
+        body = chain([b'{"base64": "'], encoded_chunks, [b'"}'])
+        return StreamingResponse(body, media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# TODO does this need to be async?
 @router.post("/internal/decode-to-file/", include_in_schema=True)
-async def decode_to_file(request: DecodeRequest, background_tasks: BackgroundTasks):
+async def decode_to_file(request: DecodeRequest):
     """
     Internal API endpoint to convert a base64-encoded string to a downloadable file.
     This endpoint is intended for use by API developers for testing.
+
+    The string is decoded in fixed-size chunks that are streamed to the client as they are
+    decoded, without writing a temporary file.
     """
+    encoded = request.encoded_data
+    chunk_size = DEFAULT_CHUNK_SIZE // 3 * 4
+    decoded_chunks = iter_base64_decode(
+        encoded[start : start + chunk_size] for start in range(0, len(encoded), chunk_size)
+    )
     try:
-        # Decode the base64 string
-        file_bytes = base64.b64decode(request.encoded_data)
-
-        # Write the decoded bytes to a temporary file
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix=f".{request.file_extension}"
-        ) as tmp_file:
-            tmp_file.write(file_bytes)
-            tmp_file_path = tmp_file.name
-        response = FileResponse(
-            tmp_file_path,
-            filename=f"decoded_file.{request.file_extension}",
-            media_type="application/octet-stream",
-        )
-
-        # Return a FileResponse that allows the file to be downloaded
-        background_tasks.add_task(os.unlink, tmp_file_path)
-        return response
+        # Decode the first chunk up front so obviously broken input still gets an error status
+        first_chunk = next(decoded_chunks, b"")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to decode and generate file: {str(e)}")
+    return StreamingResponse(
+        chain([first_chunk], decoded_chunks),
+        media_type="application/octet-stream",
+        headers={
+            "Content-Disposition": f'attachment; filename="decoded_file.{request.file_extension}"'
+        },
+    )
+
+
+@router.get("/internal/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Internal API endpoint returning the request metrics recorded by `MetricsMiddleware` and the
+    metrics of the default `TieredExecutor`, in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(
+        request_metrics.render(get_default_executor()), media_type=PROMETHEUS_MEDIA_TYPE
+    )
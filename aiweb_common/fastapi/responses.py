@@ -0,0 +1,124 @@
+import base64
+import tempfile
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+from aiweb_common.fastapi.schemas import (
+    BibTexResponse,
+    JSONResponse,
+    MSExcelResponse,
+    MSWordResponse,
+)
+from aiweb_common.file_operations.file_config import DOCX_EXPECTED_TYPE, XLSX_EXPECTED_TYPE
+
+BIBTEX_MEDIA_TYPE = "application/x-bibtex"
+JSON_MEDIA_TYPE = "application/json"
+
+# Size of the pieces written to the socket
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Documents smaller than this stay in memory when spooled; larger ones roll over to disk
+SPOOL_MAX_MEMORY = 8 * 1024 * 1024
+
+# The base64 JSON response (and its field) each media type had before binary streaming
+BASE64_RESPONSES = {
+    DOCX_EXPECTED_TYPE: (MSWordResponse, "encoded_docx"),
+    XLSX_EXPECTED_TYPE: (MSExcelResponse, "encoded_xlsx"),
+    BIBTEX_MEDIA_TYPE: (BibTexResponse, "encoded_docx"),
+    JSON_MEDIA_TYPE: (JSONResponse, "encoded_json"),
+}
+
+
+def spooled_file(max_memory=SPOOL_MAX_MEMORY):
+    """
+    Returns a temporary file to write a generated document into (e.g. `Document.save` or
+    `DataFrame.to_excel`). It stays in memory up to `max_memory` bytes and then moves to disk, and
+    it is deleted once closed, which `binary_response` does after sending it.
+    """
+    return tempfile.SpooledTemporaryFile(max_size=max_memory)
+
+
+def iter_bytes(content, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields zero-copy slices of an in-memory document."""
+    view = memoryview(content)
+    for start in range(0, len(view), chunk_size):
+        yield view[start : start + chunk_size]
+
+
+def iter_file(file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yields a file object from its start in chunks, and closes it afterwards."""
+    try:
+        file.seek(0)
+        while chunk := file.read(chunk_size):
+            yield chunk
+    finally:
+        file.close()
+
+
+def binary_response(content, media_type, filename=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    The function `binary_response` streams a document as raw bytes with its real content type,
+    using chunked transfer, instead of base64-encoding it inside JSON.
+
+    Args:
+      content: The document as bytes (or a bytearray/memoryview), or a binary file object such
+    as one from `spooled_file`. File objects are closed once sent.
+      media_type: The content type of the document, e.g. `DOCX_EXPECTED_TYPE`.
+      filename: Optional download name, sent as a Content-Disposition attachment.
+      chunk_size: Size of the chunks written to the response.
+
+    Returns:
+      A `StreamingResponse`.
+    """
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        body = iter_bytes(content, chunk_size)
+    else:
+        body = iter_file(content, chunk_size)
+    headers = {}
+    if filename is not None:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return StreamingResponse(body, media_type=media_type, headers=headers)
+
+
+def wants_binary(request: Request, media_type):
+    """
+    Whether the client explicitly asked for the raw document: with a `binary=true` query
+    parameter, application/octet-stream in its Accept header, or the document's own media type in
+    its Accept header. The last does not apply to JSON documents, since most JSON clients send
+    application/json and still expect the base64 envelope.
+    """
+    if request.query_params.get("binary", "").lower() in ("1", "true", "yes"):
+        return True
+    accept = request.headers.get("accept", "")
+    accepted = {part.split(";")[0].strip() for part in accept.split(",")}
+    if "application/octet-stream" in accepted:
+        return True
+    return media_type != JSON_MEDIA_TYPE and media_type in accepted
+
+
+def document_response(request: Request, content, media_type, filename=None):
+    """
+    The function `document_response` returns a generated document in whichever form the client
+    asks for. Clients that opt in (see `wants_binary`) get the raw bytes streamed by
+    `binary_response`. Every other client gets the base64 JSON response it received before, e.g.
+    `MSWordResponse` for DOCX documents.
+
+    Args:
+      request: The incoming request.
+      content: The document as bytes or a binary file object (see `binary_response`).
+      media_type: One of the media types in `BASE64_RESPONSES`.
+      filename: Optional download name for binary responses.
+
+    Returns:
+      A `StreamingResponse`, or the base64 response model of `media_type`.
+    """
+    if wants_binary(request, media_type):
+        return binary_response(content, media_type, filename)
+
+    if not isinstance(content, (bytes, bytearray, memoryview)):
+        with content:
+            content.seek(0)
+            content = content.read()
+    response_model, field = BASE64_RESPONSES[media_type]
+    return response_model(**{field: base64.b64encode(content).decode("utf-8")})
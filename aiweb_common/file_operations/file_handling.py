@@ -1,13 +1,23 @@
 import base64
+import re
 import tempfile
+import threading
 from datetime import datetime
 
 import magic
 from docx import Document
 from fastapi import File, HTTPException, Query, UploadFile
 
+from aiweb_common.fastapi.executor import get_default_executor
 from aiweb_common.file_operations.text_format import convert_markdown_docx
 
+# Decoded bytes handed to libmagic; OOXML (zip) documents need a few KiB to be told apart
+MIME_SNIFF_BYTES = 64 * 1024
+
+_magic_local = threading.local()
+
+_NON_BASE64_CHARACTERS = re.compile(rb"[^A-Za-z0-9+/=]")
+
 
 def file_to_base64(filepath):
     """Converts a file to a base64-encoded string."""
@@ -15,6 +25,43 @@ def file_to_base64(filepath):
         return base64.b64encode(file.read()).decode("utf-8")
 
 
+def iter_base64_encode(chunks):
+    """
+    Base64-encodes a stream of byte chunks piece by piece. Bytes that do not complete a 3-byte
+    group are carried over to the next chunk, so the concatenated output equals encoding the
+    whole stream at once.
+    """
+    remainder = b""
+    for chunk in chunks:
+        chunk = remainder + chunk
+        usable = len(chunk) - len(chunk) % 3
+        remainder = chunk[usable:]
+        if usable:
+            yield base64.b64encode(chunk[:usable])
+    if remainder:
+        yield base64.b64encode(remainder)
+
+
+def iter_base64_decode(chunks):
+    """
+    Decodes a stream of base64 chunks (str or bytes) piece by piece. Like `base64.b64decode`,
+    characters outside the base64 alphabet (e.g. line breaks) are ignored; characters that do not
+    complete a 4-character group are carried over to the next chunk. Raises ValueError on invalid
+    padding.
+    """
+    remainder = b""
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("ascii")
+        chunk = remainder + _NON_BASE64_CHARACTERS.sub(b"", chunk)
+        usable = len(chunk) - len(chunk) % 4
+        remainder = chunk[usable:]
+        if usable:
+            yield base64.b64decode(chunk[:usable])
+    if remainder:
+        yield base64.b64decode(remainder)
+
+
 def markdown_to_docx_temporary_file(content, template_location=None):
     """
     The function `prepare_docx_response` converts Markdown content to a DOCX file and returns the
@@ -58,6 +105,29 @@ async def ingest_docx(file):
         return temp_doc.name, Document(temp_doc.name)  # Load the document here
 
 
+async def amarkdown_to_docx_temporary_file(
+    content, template_location=None, executor=None, timeout=None
+):
+    """
+    Awaitable `markdown_to_docx_temporary_file`: the conversion runs in the thread tier of
+    `executor` (default: `get_default_executor()`), so the event loop stays free.
+    """
+    executor = executor or get_default_executor()
+    return await executor.run(
+        markdown_to_docx_temporary_file, content, template_location, timeout=timeout
+    )
+
+
+async def aingest_docx(file, executor=None, timeout=None):
+    """
+    Awaitable `ingest_docx`: the upload is read asynchronously, then written and parsed with
+    python-docx in the thread tier of `executor` (default: `get_default_executor()`).
+    """
+    content = await file.read()
+    executor = executor or get_default_executor()
+    return await executor.run(ingest_docx_bytes, content, timeout=timeout, name="ingest_docx")
+
+
 def ingest_docx_bytes(content):
     """
     The function `ingest_docx_bytes` reads the content of a DOCX file from bytes, saves it to a
@@ -110,10 +180,60 @@ def create_file_validator(*allowed_mime_types):
     return validate_file
 
 
+def _mime_detector():
+    # A magic.Magic handle is not thread-safe, so each worker thread keeps its own
+    detector = getattr(_magic_local, "detector", None)
+    if detector is None:
+        detector = _magic_local.detector = magic.Magic(mime=True)
+    return detector
+
+
+def _strip_whitespace(encoded):
+    # Line-wrapped (MIME-style) base64 is valid input; strict decoding only rejects other bytes
+    return encoded[:0].join(encoded.split())
+
+
+def sniff_base64_mime_type(encoded, sniff_bytes=MIME_SNIFF_BYTES):
+    """
+    Detects the MIME type of a base64-encoded file from the first `sniff_bytes` bytes only,
+    without decoding the rest of the payload. Whitespace such as line breaks is ignored. Raises
+    ValueError if that prefix is not valid base64.
+    """
+    prefix_length = (sniff_bytes + 2) // 3 * 4
+    window = prefix_length
+    while True:
+        prefix = _strip_whitespace(encoded[:window])
+        if len(prefix) >= prefix_length or window >= len(encoded):
+            break
+        window *= 2
+    prefix = prefix[:prefix_length]
+    try:
+        prefix_bytes = base64.b64decode(prefix, validate=True)
+    except ValueError:
+        raise ValueError("Invalid base64 encoding")
+    return _mime_detector().from_buffer(prefix_bytes)
+
+
+def decode_base64_file(encoded):
+    """
+    Decodes a base64-encoded file once and returns a memoryview of the bytes, so they can be
+    passed on to processing without further copies. Whitespace such as line breaks is ignored.
+    Raises ValueError on invalid base64.
+    """
+    try:
+        return memoryview(base64.b64decode(_strip_whitespace(encoded), validate=True))
+    except ValueError:
+        raise ValueError("Invalid base64 encoding")
+
+
 def create_base64_file_validator(*allowed_mime_types):
     """
     Creates a function that validates the MIME type of a base64-encoded file.
 
+    Only a prefix of the payload is decoded to detect the MIME type (see
+    `sniff_base64_mime_type`); the full payload is decoded once, later, by `decode_base64_file`
+    (e.g. in `FastAPIUploadManager.read_and_validate_file`).
+
     Args:
         allowed_mime_types (tuple): A tuple of strings representing the allowed MIME types.
 
@@ -126,14 +246,7 @@ def create_base64_file_validator(*allowed_mime_types):
         Validate the MIME type of a base64-encoded file.
         Raises ValueError if the MIME type is not what is expected.
         """
-        try:
-            file_bytes = base64.b64decode(v, validate=True)
-        except ValueError:
-            raise ValueError("Invalid base64 encoding")
-
-        # Use python-magic to check MIME type
-        mime = magic.Magic(mime=True)
-        mime_type = mime.from_buffer(file_bytes)
+        mime_type = sniff_base64_mime_type(v)
 
         if mime_type not in allowed_mime_types:
             allowed_types_formatted = ", ".join(allowed_mime_types)
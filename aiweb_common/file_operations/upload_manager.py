@@ -1,4 +1,3 @@
-import base64
 import os
 import tempfile
 from abc import abstractmethod
@@ -12,7 +11,18 @@ import streamlit as st
 from docx import Document
 from fastapi import BackgroundTasks, HTTPException
 
-from aiweb_common.file_operations.file_handling import ingest_docx_bytes
+from aiweb_common.fastapi.executor import PROCESS_TIER, get_default_executor
+from aiweb_common.file_operations.file_handling import (
+    decode_base64_file,
+    ingest_docx_bytes,
+)
+
+
+def _read_table_bytes(file: bytes, extension: str) -> pd.DataFrame:
+    # Module-level so the process tier can pickle it
+    if extension == ".xlsx":
+        return pd.read_excel(BytesIO(file))
+    return pd.read_csv(BytesIO(file))
 
 
 class UploadManager:
@@ -108,16 +118,22 @@ class StreamlitUploadManager(UploadManager):
 
 
 class FastAPIUploadManager(UploadManager):
+    # Extensions `aprocess_file_bytes` parses in the process tier with `process_tier_reader`
+    # instead of `process_file_bytes`; empty, so both APIs behave the same unless a subclass opts in
+    process_tier_extensions = ()
+
     def __init__(self, background_tasks: BackgroundTasks):
         self.background_tasks = background_tasks
 
-    def process_file_bytes(self, file: bytes, extension: str) -> Union[pd.DataFrame, str]:
+    def process_file_bytes(
+        self, file: Union[bytes, memoryview], extension: str
+    ) -> Union[pd.DataFrame, str]:
         """
         Reads the file from byte string based on the file extension and returns
         either a DataFrame or a markdown string.
 
         Args:
-            file_bytes (bytes): The byte-encoded content of the file.
+            file_bytes (bytes | memoryview): The byte-encoded content of the file.
             extension (str): The file extension indicating the file type.
 
         Returns:
@@ -133,7 +149,7 @@ class FastAPIUploadManager(UploadManager):
             return pd.read_csv(BytesIO(file))
         elif extension == ".txt":
             print("Reading text file")
-            return file.decode("utf-8")
+            return str(file, "utf-8")
         elif extension == ".docx":
             doc = Document(BytesIO(file))
             text = ""
@@ -167,11 +183,16 @@ class FastAPIUploadManager(UploadManager):
         Returns:
           The `read_and_validate_file` method returns the output of the `read_file` method if it is not
         None. If the `read_file` method returns None, a HTTPException with status code 422 and detail
-        "Failed to process the file" is raised. If any other exception occurs during the process, a
-        HTTPException with status code 500 and the exception message is raised.
+        "Failed to process the file" is raised. Invalid base64 raises a HTTPException with status
+        code 422. If any other exception occurs during the process, a HTTPException with status code
+        500 and the exception message is raised.
         """
         try:
-            file_bytes = base64.b64decode(encoded_file)
+            # Decoded once; the validators only decode a prefix to check the MIME type
+            file_bytes = decode_base64_file(encoded_file)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e)) from e
+        try:
             output = self.process_file_bytes(file_bytes, extension)
             if output is None:
                 raise HTTPException(status_code=422, detail="Failed to process the file")
@@ -179,12 +200,67 @@ class FastAPIUploadManager(UploadManager):
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e)) from e
 
+    def process_tier_reader(self, extension):
+        """
+        Returns the picklable, module-level function `(file_bytes, extension)` that parses
+        `process_tier_extensions` in the process tier. The default reads Excel and CSV files like
+        `process_file_bytes`, so a subclass can opt in with
+        `process_tier_extensions = (".xlsx", ".csv")`.
+        """
+        return _read_table_bytes
+
+    async def aprocess_file_bytes(
+        self, file: Union[bytes, memoryview], extension: str, executor=None, timeout=None
+    ) -> Any:
+        """
+        Awaitable `process_file_bytes` for async handlers: it runs in the thread tier of `executor`
+        (default: `get_default_executor()`). Extensions listed in `process_tier_extensions` are
+        parsed by `process_tier_reader` in the process tier instead, so work that holds the GIL
+        does not slow down other requests.
+        """
+        executor = executor or get_default_executor()
+        if extension in self.process_tier_extensions:
+            # memoryviews cannot be pickled, so the process tier gets a bytes copy
+            return await executor.run(
+                self.process_tier_reader(extension),
+                bytes(file),
+                extension,
+                tier=PROCESS_TIER,
+                timeout=timeout,
+                name=f"read{extension.replace('.', '_')}",
+            )
+        return await executor.run(
+            self.process_file_bytes, file, extension, timeout=timeout, name="process_file_bytes"
+        )
+
+    async def aread_and_validate_file(
+        self, encoded_file: str, extension: str, executor=None, timeout=None
+    ) -> Any:
+        """
+        Awaitable `read_and_validate_file`: decoding and processing run in `executor`, with the same
+        error statuses, plus 503 when the executor queue is full and 504 on timeout.
+        """
+        executor = executor or get_default_executor()
+        try:
+            file_bytes = await executor.run(decode_base64_file, encoded_file)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e)) from e
+        try:
+            output = await self.aprocess_file_bytes(file_bytes, extension, executor, timeout)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e)) from e
+        if output is None:
+            raise HTTPException(status_code=422, detail="Failed to process the file")
+        return output
+
 
 class BytesToDocx(FastAPIUploadManager):
     def __init__(self, background_tasks):
         super().__init__(background_tasks)
 
-    def process_file_bytes(self, file: bytes, extension=".docx") -> Document:
+    def process_file_bytes(self, file: Union[bytes, memoryview], extension=".docx") -> Document:
         """
         The function `process_file_bytes` processes a file in bytes format, specifically for a .docx
         extension, and returns a Document object while also handling background tasks.
@@ -1,31 +1,175 @@
+import asyncio
 import csv
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass, field
 from pathlib import Path
 
+import faiss
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.document_loaders.csv_loader import CSVLoader
 from langchain_community.document_loaders.pdf import PyMuPDFLoader
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
 
+from aiweb_common.generate.MetadataFilterIndex import MetadataFilterIndex
+from aiweb_common.generate.NearDuplicateFilter import NearDuplicateFilter
 from aiweb_common.generate.QueryInterface import QueryInterface
+from aiweb_common.generate.VectorIndexFactory import (
+    TRAINED_INDEX_TYPES,
+    create_index,
+    filtered_search,
+    tune_index,
+)
+
+# Seconds each source gets in `retrieve_data_concurrently` when no timeout is given for it
+DEFAULT_SOURCE_TIMEOUT = 30
+
+
+class _SourceTimedOut(Exception):
+    pass
 
 
 # TODO Add documentation for methods and classes throughout
 class RAGServicer(QueryInterface):
-    def __init__(self, language_model_interface, embedding_interface, vectorstore: Path):
+    def __init__(
+        self,
+        language_model_interface,
+        embedding_interface,
+        vectorstore: Path | FAISS,
+        nprobe=None,
+        ef_search=None,
+        filter_index=None,
+    ):
+        """
+        Args:
+            language_model_interface: The LangChain chat model.
+            embedding_interface: The LangChain embedding interface used to embed queries.
+            vectorstore: Folder of a saved FAISS vectorstore, or an in-memory `FAISS` object (e.g.
+                from `PubMedVectorIndex`).
+            nprobe: Optional number of IVF lists visited per query.
+            ef_search: Optional HNSW search depth.
+            filter_index: Optional `MetadataFilterIndex` of an in-memory vectorstore; saved
+                vectorstores load theirs from disk.
+        """
         self.vectorstore = vectorstore
         self.embedding_interface = embedding_interface
+        # Query-time accuracy/latency knobs for IVF (nprobe) and HNSW (ef_search) indexes
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self._vectordb = None
+        self._filter_index = filter_index
         super().__init__(language_model_interface)
 
-    def retrieve_data(self, query):
-        vectordb = FAISS.load_local(
-            self.vectorstore,
-            self.embedding_interface,
-            allow_dangerous_deserialization=True,
-        )
-        docsearch = vectordb.as_retriever()
+    def _load_vectorstore(self):
+        # Loaded once and reused; reading a large index from disk on every query dominates latency
+        if self._vectordb is None and isinstance(self.vectorstore, FAISS):
+            tune_index(self.vectorstore.index, nprobe=self.nprobe, ef_search=self.ef_search)
+            self._vectordb = self.vectorstore
+        elif self._vectordb is None:
+            vectordb = FAISS.load_local(
+                self.vectorstore,
+                self.embedding_interface,
+                allow_dangerous_deserialization=True,
+            )
+            tune_index(vectordb.index, nprobe=self.nprobe, ef_search=self.ef_search)
+            self._filter_index = MetadataFilterIndex.load(self.vectorstore)
+            self._vectordb = vectordb
+        return self._vectordb
+
+    def _filter_ids(self, filter):
+        if self._filter_index is None:
+            raise ValueError(
+                "This vectorstore has no metadata filter index. Rebuild it with VectorStoreBuilder."
+            )
+        return self._filter_index.select(filter)
+
+    def retrieve_data(self, query, filter=None, k=4):
+        """
+        The function `retrieve_data` retrieves the documents most similar to `query`.
+
+        Args:
+          query: The query string.
+          filter: Optional; a metadata filter expression such as `{"source": "report.pdf"}`. Only
+        vectors matching the filter are considered by the FAISS search. See `MetadataFilterIndex`.
+          k: The number of documents to retrieve.
+
+        Returns:
+          A list of retrieved `Document` objects ordered from most to least similar.
+        """
+        if filter is not None:
+            return self.retrieve_batch([query], k=k, filter=filter)[0]
+        vectordb = self._load_vectorstore()
+        docsearch = vectordb.as_retriever(search_kwargs={"k": k})
         retrieved_data = docsearch.invoke(query)
         return retrieved_data
 
+    def retrieve_batch(self, queries, k=4, score_threshold=None, filter=None):
+        """
+        The function `retrieve_batch` retrieves documents for several queries at once, running one
+        vectorized FAISS search over the query matrix instead of one search per query. Queries are
+        embedded with `embed_query`, as in `retrieve_data`, so results match single-query retrieval
+        for models that embed queries and documents differently; repeated queries are embedded once.
+
+        Args:
+          queries: A list of query strings.
+          k: The number of documents to retrieve per query. Defaults to 4, matching `retrieve_data`.
+          score_threshold: Optional; a raw FAISS score cut-off. Results must be at or below it for
+        distance metrics (the default L2 index) and at or above it for inner-product indexes.
+          filter: Optional; a metadata filter expression applied to every query (see `retrieve_data`).
+
+        Returns:
+          A list with one entry per query, in input order, each being the list of retrieved
+        `Document` objects ordered from most to least similar.
+        """
+        if not queries:
+            return []
+
+        vectordb = self._load_vectorstore()
+        vector_by_query = {
+            query: self.embedding_interface.embed_query(query) for query in dict.fromkeys(queries)
+        }
+        query_vectors = np.asarray([vector_by_query[query] for query in queries], dtype=np.float32)
+        if vectordb._normalize_L2:
+            faiss.normalize_L2(query_vectors)
+        if filter is not None:
+            scores, indices = filtered_search(
+                vectordb.index,
+                query_vectors,
+                k,
+                self._filter_ids(filter),
+                nprobe=self.nprobe,
+                ef_search=self.ef_search,
+            )
+        else:
+            scores, indices = vectordb.index.search(query_vectors, k)
+
+        higher_is_better = vectordb.distance_strategy in (
+            DistanceStrategy.MAX_INNER_PRODUCT,
+            DistanceStrategy.JACCARD,
+        )
+        retrieved_data = []
+        for query_scores, query_indices in zip(scores, indices):
+            documents = []
+            for score, index in zip(query_scores, query_indices):
+                # FAISS pads with -1 when fewer than k vectors are available
+                if index == -1:
+                    continue
+                if score_threshold is not None and (
+                    score < score_threshold if higher_is_better else score > score_threshold
+                ):
+                    continue
+                docstore_id = vectordb.index_to_docstore_id[index]
+                documents.append(vectordb.docstore.search(docstore_id))
+            retrieved_data.append(documents)
+        return retrieved_data
+
 
 class SearchServicer(QueryInterface):
     def __init__(self, language_model_interface, searchable):
@@ -40,12 +184,259 @@ class SearchServicer(QueryInterface):
         )  # Search documents based on the searchable input
         return retrieved_data
 
+    def _source_timeout(self, timeout, name):
+        if isinstance(timeout, dict):
+            return timeout.get(name, DEFAULT_SOURCE_TIMEOUT)
+        return timeout
+
+    def retrieve_data_concurrently(
+        self, search_functions, timeout=DEFAULT_SOURCE_TIMEOUT, dedup_key=None
+    ):
+        """
+        The function `retrieve_data_concurrently` runs several search callables (e.g. PubMed, NIH
+        RePORTER and a local vectorstore search) at the same time on a thread pool, so the total
+        latency approaches that of the slowest source instead of the sum of all of them.
+
+        Args:
+          search_functions: A dict mapping a source name to a callable that takes `searchable`,
+        exactly like the `search_function` passed to `retrieve_data`.
+          timeout: Seconds to wait for each source, or a dict of per-source timeouts; sources
+        missing from the dict get `DEFAULT_SOURCE_TIMEOUT`. Sources that do not answer in time are
+        reported in `timed_out` and left out of the results. A source that raises `TimeoutError`
+        itself is reported in `errors`.
+          dedup_key: Optional; a function mapping a result item to the key used to drop duplicates
+        across sources. See `_default_dedup_key` for the default.
+
+        Returns:
+          A `FanOutResult` with the merged, deduplicated results, the results per source, and the
+        sources that failed or timed out.
+        """
+        executor = ThreadPoolExecutor(max_workers=max(1, len(search_functions)))
+        futures = {
+            name: executor.submit(search_function, self.searchable)
+            for name, search_function in search_functions.items()
+        }
+        start = time.monotonic()
+        outcome = FanOutResult()
+        try:
+            for name, future in futures.items():
+                source_timeout = self._source_timeout(timeout, name)
+                remaining = None
+                if source_timeout is not None:
+                    remaining = max(0, source_timeout - (time.monotonic() - start))
+                try:
+                    outcome.by_source[name] = future.result(timeout=remaining)
+                except FutureTimeoutError as e:
+                    # A finished future raised TimeoutError itself, which is a source error
+                    if future.done():
+                        outcome.errors[name] = e
+                    else:
+                        outcome.timed_out.append(name)
+                except Exception as e:
+                    outcome.errors[name] = e
+        finally:
+            # Do not block on sources that timed out; their threads finish in the background
+            executor.shutdown(wait=False, cancel_futures=True)
+        outcome.merge(dedup_key)
+        return outcome
+
+    async def aretrieve_data_concurrently(
+        self, search_functions, timeout=DEFAULT_SOURCE_TIMEOUT, dedup_key=None
+    ):
+        """
+        The asyncio counterpart of `retrieve_data_concurrently`. Coroutine functions are awaited
+        directly and plain callables are run in worker threads.
+        """
+
+        async def run(name, search_function):
+            if asyncio.iscoroutinefunction(search_function):
+                call = search_function(self.searchable)
+            else:
+                call = asyncio.to_thread(search_function, self.searchable)
+            task = asyncio.ensure_future(call)
+            done, _ = await asyncio.wait({task}, timeout=self._source_timeout(timeout, name))
+            if not done:
+                task.cancel()
+                raise _SourceTimedOut()
+            return task.result()
+
+        names = list(search_functions)
+        results = await asyncio.gather(
+            *(run(name, search_functions[name]) for name in names), return_exceptions=True
+        )
+        outcome = FanOutResult()
+        for name, result in zip(names, results):
+            if isinstance(result, _SourceTimedOut):
+                outcome.timed_out.append(name)
+            elif isinstance(result, Exception):
+                outcome.errors[name] = result
+            else:
+                outcome.by_source[name] = result
+        outcome.merge(dedup_key)
+        return outcome
+
+
+def _default_dedup_key(item):
+    # Documents by their text, PubMed rows by PMID, anything else by its string form
+    if isinstance(item, Document):
+        return item.page_content
+    if isinstance(item, dict):
+        for key in ("pmid", "appl_id", "id"):
+            if item.get(key) is not None:
+                return (key, str(item[key]))
+    return str(item)
+
+
+@dataclass
+class FanOutResult:
+    """The merged outcome of `SearchServicer.retrieve_data_concurrently`."""
+
+    results: list = field(default_factory=list)
+    by_source: dict = field(default_factory=dict)
+    errors: dict = field(default_factory=dict)
+    timed_out: list = field(default_factory=list)
+
+    def merge(self, dedup_key=None):
+        dedup_key = dedup_key or _default_dedup_key
+        seen = set()
+        self.results = []
+        for source_results in self.by_source.values():
+            if source_results is None:
+                continue
+            if isinstance(source_results, pd.DataFrame):
+                source_results = source_results.to_dict("records")
+            for item in source_results:
+                key = dedup_key(item)
+                if key not in seen:
+                    seen.add(key)
+                    self.results.append(item)
+        return self.results
+
 
 class VectorStoreBuilder:
     # TODO make into factory for PDF/CSV and allowing for future file type integrations
-    def __init__(self, embedding_model, output_faiss: Path):
+    def __init__(
+        self,
+        embedding_model,
+        output_faiss: Path,
+        index_type="flat",
+        training_sample_size=100_000,
+        filter_fields=("source",),
+        near_duplicate_threshold=None,
+        chunker=None,
+        **index_params,
+    ):
+        """
+        Args:
+            embedding_model: The LangChain embedding interface used to embed documents.
+            output_faiss: Folder the FAISS vectorstore is saved to.
+            index_type: FAISS index to build - "flat" (exact, default), "ivf", "hnsw", "pq"
+                (IVF with product-quantized vectors), "float16" or "ivf_float16".
+            training_sample_size: Number of vectors collected to train "ivf"/"pq"/"ivf_float16"
+                indexes before the rest of the corpus is added.
+            filter_fields: Metadata fields indexed for filtered retrieval in `RAGServicer`.
+            near_duplicate_threshold: Optional; drop documents whose estimated Jaccard similarity
+                to an earlier document reaches this value before embedding them. What was
+                collapsed is saved to `near_duplicates.csv` next to the vectorstore.
+            chunker: Optional; a `TokenChunker` that splits documents (e.g. whole PDF pages or long
+                CSV rows) into overlapping token-bounded chunks and packs them into embedding
+                batches sized to the model's token limit.
+            **index_params: Builder options passed to `VectorIndexFactory.create_index`, e.g.
+                `nlist`, `hnsw_m`, `ef_construction`, `pq_m`, `pq_bits`.
+        """
         self.embedding_model = embedding_model
         self.out = output_faiss
+        self.index_type = index_type
+        self.training_sample_size = training_sample_size
+        self.filter_fields = filter_fields
+        self.filter_index = MetadataFilterIndex(filter_fields)
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.near_duplicate_filter = None
+        self.chunker = chunker
+        self.index_params = index_params
+
+    def _embed_documents(self, documents):
+        vectors = self.embedding_model.embed_documents([doc.page_content for doc in documents])
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _create_index(self, buffered):
+        return create_index(
+            self.index_type,
+            np.vstack([vectors for vectors, _ in buffered]),
+            training_sample_size=self.training_sample_size,
+            **self.index_params,
+        )
+
+    def _build_vectorstore(self, document_batches):
+        """
+        Embeds batches of documents into a FAISS vectorstore of the configured index type. Index
+        types that need training buffer the leading batches until `training_sample_size` vectors
+        are available, train on them, and then add everything.
+        """
+        index = None
+        docstore = {}
+        index_to_docstore_id = {}
+        self.filter_index = MetadataFilterIndex(self.filter_fields)
+        if self.near_duplicate_threshold is not None:
+            self.near_duplicate_filter = NearDuplicateFilter(self.near_duplicate_threshold)
+        if self.chunker is not None:
+            document_batches = self.chunker.rebatch(document_batches)
+        buffered = []
+        buffered_count = 0
+
+        def add(vectors, documents):
+            index.add(vectors)
+            for document in documents:
+                position = len(index_to_docstore_id)
+                docstore_id = str(uuid.uuid4())
+                index_to_docstore_id[position] = docstore_id
+                docstore[docstore_id] = document
+                self.filter_index.add(position, document.metadata)
+
+        for documents in document_batches:
+            if self.near_duplicate_filter is not None:
+                documents = self.near_duplicate_filter.filter(documents)
+            if not documents:
+                continue
+            vectors = self._embed_documents(documents)
+            if index is not None:
+                add(vectors, documents)
+                continue
+
+            buffered.append((vectors, documents))
+            buffered_count += len(documents)
+            if (
+                self.index_type in TRAINED_INDEX_TYPES
+                and buffered_count < self.training_sample_size
+            ):
+                continue
+            index = self._create_index(buffered)
+            for batch_vectors, batch_documents in buffered:
+                add(batch_vectors, batch_documents)
+            buffered = []
+
+        if index is None and buffered:
+            # Corpus smaller than the training sample - train on everything we have
+            index = self._create_index(buffered)
+            for batch_vectors, batch_documents in buffered:
+                add(batch_vectors, batch_documents)
+        if index is None:
+            raise ValueError("No documents found to add to the vectorstore.")
+
+        return FAISS(
+            embedding_function=self.embedding_model,
+            index=index,
+            docstore=InMemoryDocstore(docstore),
+            index_to_docstore_id=index_to_docstore_id,
+        )
+
+    def _save(self, vector_store):
+        vector_store.save_local(self.out)
+        self.filter_index.save(self.out)
+        if self.near_duplicate_filter is not None:
+            self.near_duplicate_filter.report().to_csv(
+                Path(self.out) / "near_duplicates.csv", index=False
+            )
 
     def _clean_csv(self, input_csv):
         # Make sure the data frame is clean - remove NaN and drop duplicates
@@ -56,15 +447,116 @@ class VectorStoreBuilder:
         df.to_csv(clean_csv_path, index=False, quoting=csv.QUOTE_ALL)
         return clean_csv_path
 
-    def convert_csv_to_vectorstore(self, input_csv, clean_csv=False):
+    def _stream_csv_documents(self, input_csv, clean_csv, batch_size, chunksize):
+        """
+        Reads `input_csv` in chunks and yields lists of at most `batch_size` documents, formatted
+        like `CSVLoader` output. With `clean_csv`, rows containing NaN are dropped and duplicates are
+        removed using a set of 64-bit row hashes, so no intermediate clean CSV is written.
+        """
+        seen_row_hashes = set()
+        batch = []
+        row_number = 0
+        chunks = pd.read_csv(
+            input_csv,
+            chunksize=chunksize,
+            dtype=str,
+            keep_default_na=clean_csv,
+            na_values=[""] if clean_csv else None,
+        )
+        for chunk in chunks:
+            chunk.columns = [str(column).strip() for column in chunk.columns]
+            row_numbers = range(row_number, row_number + len(chunk))
+            row_number += len(chunk)
+            if clean_csv:
+                keep = chunk.notna().all(axis=1).tolist()
+                for position, row_hash in enumerate(
+                    pd.util.hash_pandas_object(chunk, index=False).tolist()
+                ):
+                    if keep[position]:
+                        keep[position] = row_hash not in seen_row_hashes
+                        seen_row_hashes.add(row_hash)
+                chunk = chunk[keep]
+                row_numbers = [number for number, kept in zip(row_numbers, keep) if kept]
+
+            for row, values in zip(row_numbers, chunk.itertuples(index=False, name=None)):
+                content = "\n".join(
+                    f"{column}: {value.strip()}" for column, value in zip(chunk.columns, values)
+                )
+                batch.append(
+                    Document(page_content=content, metadata={"source": str(input_csv), "row": row})
+                )
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def convert_csv_to_vectorstore(
+        self, input_csv, clean_csv=False, streaming=False, batch_size=1000, chunksize=50_000
+    ):
+        """
+        The function `convert_csv_to_vectorstore` embeds each row of a CSV file as a document and
+        saves the resulting FAISS vectorstore.
+
+        Args:
+          input_csv: Path to the CSV file.
+          clean_csv: Whether to drop rows with missing values and duplicate rows first.
+          streaming: Read, clean and embed the CSV in chunks instead of loading it all at once. Use
+        this for multi-GB exports; memory for the raw rows and embeddings is then bounded by
+        `chunksize`/`batch_size` (plus the training sample for trained index types).
+          batch_size: Number of documents embedded per batch when streaming.
+          chunksize: Number of CSV rows read per pandas chunk when streaming.
+        """
+        if streaming:
+            document_batches = self._stream_csv_documents(
+                input_csv, clean_csv, batch_size, chunksize
+            )
+            vector_store = self._build_vectorstore(document_batches)
+            self._save(vector_store)
+            return
+
         if clean_csv:
             input_csv = self._clean_csv(input_csv)
 
         csv_loader = CSVLoader(file_path=input_csv)
         documents = csv_loader.load()
 
-        vector_store = FAISS.from_documents(documents, self.embedding_model)
-        vector_store.save_local(self.out)
+        vector_store = self._build_vectorstore([documents])
+        self._save(vector_store)
+
+    def convert_parquet_to_vectorstore(self, input_parquet, batch_size=1000):
+        """
+        The function `convert_parquet_to_vectorstore` embeds each row of a Parquet file (e.g. from
+        `NIHRePORTERAPI.scrape_nih_reporter_parquet`) as a document, formatted like the CSV rows
+        of `convert_csv_to_vectorstore`, and saves the resulting FAISS vectorstore. The file is
+        read one record batch at a time.
+
+        Args:
+          input_parquet: Path to the Parquet file.
+          batch_size: Number of rows read and embedded per batch.
+        """
+
+        def document_batches():
+            row = 0
+            for record_batch in pq.ParquetFile(input_parquet).iter_batches(batch_size=batch_size):
+                # Nullable integer columns such as appl_id stay ints instead of becoming floats
+                frame = record_batch.to_pandas(integer_object_nulls=True).fillna("").astype(str)
+                documents = []
+                for values in frame.itertuples(index=False, name=None):
+                    content = "\n".join(
+                        f"{column}: {value.strip()}" for column, value in zip(frame.columns, values)
+                    )
+                    documents.append(
+                        Document(
+                            page_content=content,
+                            metadata={"source": str(input_parquet), "row": row},
+                        )
+                    )
+                    row += 1
+                yield documents
+
+        vector_store = self._build_vectorstore(document_batches())
+        self._save(vector_store)
 
     def load_pdf_and_process(self, file_path):
         loader = PyMuPDFLoader(file_path)
@@ -75,13 +567,6 @@ class VectorStoreBuilder:
         folder_path = Path(pdf_folder)
         list_of_docs = folder_path.glob("**/*.pdf")
 
-        vector_store = None
-        for idx, file_path in enumerate(list_of_docs):
-            document = self.load_pdf_and_process(file_path)
-            if idx == 0:
-                vector_store = FAISS.from_documents(document, self.embedding_model)
-            else:
-                vector_store_idx = FAISS.from_documents(document, self.embedding_model)
-                vector_store.merge_from(vector_store_idx)
-
-        vector_store.save_local(self.out)
+        documents_per_file = (self.load_pdf_and_process(file_path) for file_path in list_of_docs)
+        vector_store = self._build_vectorstore(documents_per_file)
+        self._save(vector_store)
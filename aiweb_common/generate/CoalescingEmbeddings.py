@@ -0,0 +1,184 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from queue import Empty, Queue
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+_STOP = object()
+
+DOCUMENTS = "documents"
+QUERY = "query"
+
+# Packages whose embedding interfaces implement embed_query as embed_documents([text])[0]
+QUERY_AS_DOCUMENT_PACKAGES = ("langchain_openai",)
+
+
+def _embeds_queries_as_documents(embedding_interface):
+    package = type(embedding_interface).__module__.split(".")[0]
+    return package in QUERY_AS_DOCUMENT_PACKAGES
+
+
+class CoalescingEmbeddings(Embeddings):
+    """
+    The `CoalescingEmbeddings` class wraps a LangChain embedding interface and collects concurrent
+    `embed_query`/`embed_documents` calls for a short window, sending them to the embedding endpoint
+    as one batched request and handing each caller back its own slice of the result.
+
+    It can be passed anywhere an embedding interface is expected (e.g. `RAGServicer`), and is safe
+    to call from multiple threads as well as from asyncio code.
+
+    For the OpenAI/Azure embedding interfaces used in our apps, whose `embed_query` is
+    `embed_documents` on a single text, queries join the documents in the same batched request.
+    Other models (e.g. BGE or instructor prefixes, Cohere/Voyage `input_type`) may embed queries
+    differently, so their coalesced queries are sent through `embed_query`, concurrently rather
+    than one after another. `queries_as_documents` overrides the detection either way.
+    """
+
+    def __init__(
+        self,
+        embedding_interface,
+        max_wait_ms: float = 5,
+        max_batch_size: int = 256,
+        queries_as_documents: bool = None,
+        max_query_workers: int = 16,
+    ):
+        """
+        Args:
+            embedding_interface: The LangChain embedding interface that performs the actual requests.
+            max_wait_ms: How long to wait for further calls to join a batch once the first one arrives.
+            max_batch_size: Number of texts after which a batch is sent without waiting any longer.
+            queries_as_documents: Whether queries may be embedded with `embed_documents` together
+                with the documents of the batch. Defaults to True for the interfaces of
+                `QUERY_AS_DOCUMENT_PACKAGES` and False otherwise.
+            max_query_workers: Number of concurrent `embed_query` calls when queries are not
+                embedded as documents.
+        """
+        self.embedding_interface = embedding_interface
+        if queries_as_documents is None:
+            queries_as_documents = _embeds_queries_as_documents(embedding_interface)
+        self.queries_as_documents = queries_as_documents
+        self.max_query_workers = max_query_workers
+        self._query_pool = None
+        self.max_wait_seconds = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.requests_sent = 0
+        self.texts_embedded = 0
+        self._pending = Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name="embedding-coalescer", daemon=True
+                )
+                self._worker.start()
+
+    def _submit(self, texts, kind=DOCUMENTS) -> Future:
+        future = Future()
+        if self.queries_as_documents:
+            kind = DOCUMENTS
+        self._pending.put((list(texts), kind, future))
+        self._ensure_worker()
+        return future
+
+    def _collect_batch(self):
+        # Block until the first request arrives, then give others a short window to join it
+        first = self._pending.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        batch_size = len(first[0])
+        deadline = time.monotonic() + self.max_wait_seconds
+        while batch_size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._pending.get(timeout=remaining)
+            except Empty:
+                break
+            if item is _STOP:
+                # Finish the current batch first, then stop on the next loop
+                self._pending.put(_STOP)
+                break
+            batch.append(item)
+            batch_size += len(item[0])
+        return batch
+
+    def _embed(self, kind, unique_texts):
+        if kind == DOCUMENTS:
+            vectors = self.embedding_interface.embed_documents(unique_texts)
+            self.requests_sent += 1
+        else:
+            if self._query_pool is None:
+                self._query_pool = ThreadPoolExecutor(
+                    max_workers=self.max_query_workers, thread_name_prefix="embedding-query"
+                )
+            vectors = list(self._query_pool.map(self.embedding_interface.embed_query, unique_texts))
+            self.requests_sent += len(unique_texts)
+        if len(vectors) != len(unique_texts):
+            raise ValueError(
+                f"The embedding interface returned {len(vectors)} vectors for "
+                f"{len(unique_texts)} texts."
+            )
+        self.texts_embedded += len(unique_texts)
+        return dict(zip(unique_texts, vectors))
+
+    def _flush(self, batch):
+        for kind in (DOCUMENTS, QUERY):
+            requests = [
+                (texts, future) for texts, request_kind, future in batch if request_kind == kind
+            ]
+            if not requests:
+                continue
+            try:
+                # Identical texts (e.g. the same question from several users) are only embedded once
+                unique_texts = list(dict.fromkeys(text for texts, _ in requests for text in texts))
+                vector_by_text = self._embed(kind, unique_texts)
+                for texts, future in requests:
+                    future.set_result([vector_by_text[text] for text in texts])
+            except Exception as e:
+                # Never leave a caller waiting on a future the worker will not resolve
+                for _, future in requests:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                return
+            self._flush(batch)
+
+    def close(self):
+        """Stops the background worker once all pending requests have been sent."""
+        if self._worker is not None and self._worker.is_alive():
+            self._pending.put(_STOP)
+            self._worker.join()
+        if self._query_pool is not None:
+            self._query_pool.shutdown()
+            self._query_pool = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._submit(texts).result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._submit([text], QUERY).result()[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return await asyncio.wrap_future(self._submit(texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vectors = await asyncio.wrap_future(self._submit([text], QUERY))
+        return vectors[0]
@@ -0,0 +1,84 @@
+import json
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+FILTER_INDEX_FILENAME = "filter_index.json"
+
+
+class MetadataFilterIndex:
+    """
+    The `MetadataFilterIndex` class is an inverted index from document metadata values (e.g. the
+    source PDF, a year or a department) to the positions of the matching vectors in a FAISS index.
+    It is built alongside the vectorstore by `VectorStoreBuilder` and saved next to it, so that
+    `RAGServicer` can turn a filter expression into a FAISS ID selector without touching the
+    documents themselves.
+
+    Filter expressions are dicts mapping a metadata field to a value or a list of values. Values of
+    one field are OR-ed together and different fields are AND-ed, e.g.
+    `{"source": ["a.pdf", "b.pdf"], "year": 2023}`.
+    """
+
+    def __init__(self, fields=("source",)):
+        self.fields = tuple(fields)
+        self._ids = {field: defaultdict(list) for field in self.fields}
+        self._arrays = {}
+
+    def add(self, position, metadata):
+        """Records the metadata of the vector stored at `position` in the FAISS index."""
+        for field in self.fields:
+            value = metadata.get(field)
+            if value is not None:
+                self._ids[field][str(value)].append(position)
+        self._arrays.clear()
+
+    def _array(self, field, value):
+        key = (field, value)
+        if key not in self._arrays:
+            self._arrays[key] = np.asarray(self._ids[field].get(value, []), dtype=np.int64)
+        return self._arrays[key]
+
+    def select(self, filter_expression):
+        """
+        The function `select` resolves a filter expression to the sorted vector ids it matches.
+
+        Args:
+          filter_expression: A dict mapping metadata fields to a value or a list of values.
+
+        Returns:
+          A sorted int64 array of FAISS vector ids matching every field of the expression.
+        """
+        selected = None
+        for field, values in filter_expression.items():
+            if field not in self._ids:
+                raise KeyError(
+                    f"Metadata field '{field}' is not indexed. Indexed fields: {list(self.fields)}"
+                )
+            if not isinstance(values, (list, tuple, set)):
+                values = [values]
+            matches = np.unique(
+                np.concatenate(
+                    [self._array(field, str(value)) for value in values]
+                    + [np.empty(0, dtype=np.int64)]
+                )
+            )
+            selected = matches if selected is None else np.intersect1d(selected, matches)
+        return selected if selected is not None else np.empty(0, dtype=np.int64)
+
+    def save(self, folder):
+        with open(Path(folder) / FILTER_INDEX_FILENAME, "w") as f:
+            json.dump({"fields": list(self.fields), "ids": self._ids}, f)
+
+    @classmethod
+    def load(cls, folder):
+        """Loads the filter index saved in a vectorstore folder, or returns None if there is none."""
+        path = Path(folder) / FILTER_INDEX_FILENAME
+        if not path.exists():
+            return None
+        with open(path, "r") as f:
+            saved = json.load(f)
+        filter_index = cls(saved["fields"])
+        for field, value_ids in saved["ids"].items():
+            filter_index._ids[field].update(value_ids)
+        return filter_index
@@ -0,0 +1,131 @@
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def _choose_bands(num_perm, threshold):
+    # Pick the (bands, rows) split whose LSH S-curve midpoint (1/b)^(1/r) is closest to threshold
+    splits = [
+        (bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0
+    ]
+    return min(splits, key=lambda split: abs((1 / split[0]) ** (1 / split[1]) - threshold))
+
+
+class NearDuplicateFilter:
+    """
+    The `NearDuplicateFilter` class drops documents whose text is nearly identical to a document it
+    has already seen (e.g. resubmitted grants, preprint/published pairs, repeated PDF pages) before
+    they are embedded.
+
+    Each document is reduced to a MinHash signature of its word shingles. Locality-sensitive
+    hashing over bands of the signature finds candidate matches in constant time per document, and
+    a candidate is only treated as a duplicate when the estimated Jaccard similarity reaches
+    `threshold`. Documents are processed as a stream, so the filter can sit in front of batched
+    embedding; what was collapsed is available from `report()`.
+    """
+
+    def __init__(self, threshold=0.9, num_perm=128, shingle_size=5, seed=0):
+        """
+        Args:
+            threshold: Estimated Jaccard similarity at or above which a document is a duplicate.
+            num_perm: Number of MinHash permutations; more is more accurate but uses more memory.
+            shingle_size: Number of consecutive words per shingle.
+            seed: Seed for the permutation parameters.
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = _choose_bands(num_perm, threshold)
+
+        # a, b < 2**32 keep a * x + b within uint64 for 32-bit shingle hashes
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+
+        self._buckets = [{} for _ in range(self.bands)]
+        self._signatures = []
+        self._kept_metadata = []
+        self._collapsed = []
+
+    def _signature(self, text):
+        words = _WORD_PATTERN.findall(text.lower())
+        if not words:
+            return None
+        size = min(self.shingle_size, len(words))
+        shingles = {" ".join(words[i : i + size]) for i in range(len(words) - size + 1)}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        permuted = ((hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME) & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows : (band + 1) * self.rows].tobytes()
+
+    def _find_duplicate(self, signature):
+        checked = set()
+        for band, key in self._band_keys(signature):
+            candidate = self._buckets[band].get(key)
+            if candidate is None or candidate in checked:
+                continue
+            checked.add(candidate)
+            similarity = float(np.mean(self._signatures[candidate] == signature))
+            if similarity >= self.threshold:
+                return candidate, similarity
+        return None, None
+
+    def is_duplicate(self, document):
+        """
+        The function `is_duplicate` checks a document against those seen so far and remembers it
+        if it is new.
+
+        Args:
+          document: A LangChain `Document`.
+
+        Returns:
+          True if the document is a near-duplicate of an earlier one, otherwise False.
+        """
+        signature = self._signature(document.page_content)
+        if signature is None:
+            return False
+
+        duplicate_of, similarity = self._find_duplicate(signature)
+        if duplicate_of is not None:
+            self._collapsed.append(
+                {
+                    "removed": document.metadata,
+                    "kept": self._kept_metadata[duplicate_of],
+                    "similarity": similarity,
+                }
+            )
+            return True
+
+        position = len(self._signatures)
+        self._signatures.append(signature)
+        self._kept_metadata.append(document.metadata)
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, position)
+        return False
+
+    def filter(self, documents):
+        """Returns the documents of a batch that are not near-duplicates of anything seen so far."""
+        return [document for document in documents if not self.is_duplicate(document)]
+
+    def report(self):
+        """
+        The function `report` lists the documents that were collapsed.
+
+        Returns:
+          A DataFrame with the metadata of each removed document, the metadata of the document it
+        was collapsed into, and their estimated Jaccard similarity.
+        """
+        return pd.DataFrame(self._collapsed, columns=["removed", "kept", "similarity"])
@@ -0,0 +1,93 @@
+from itertools import chain
+
+import tiktoken
+from langchain_core.documents import Document
+
+
+class TokenChunker:
+    """
+    The `TokenChunker` class splits documents into chunks of at most `chunk_tokens` tokens, with
+    `overlap_tokens` tokens shared between neighbouring chunks, and packs the chunks into embedding
+    batches that stay under a token budget. Chunks keep the metadata of their document (e.g. source
+    and page) plus their chunk number.
+
+    Everything is done with generators, so only the documents of the batch being built are held in
+    memory.
+    """
+
+    def __init__(
+        self,
+        chunk_tokens=512,
+        overlap_tokens=64,
+        max_batch_tokens=100_000,
+        max_batch_size=2048,
+        encoding_name="cl100k_base",
+    ):
+        """
+        Args:
+            chunk_tokens: Maximum tokens per chunk. Keep below the embedding model's input limit
+                (8191 for the OpenAI embedding models).
+            overlap_tokens: Tokens repeated at the start of the next chunk to preserve context.
+            max_batch_tokens: Token budget of a single embedding request.
+            max_batch_size: Maximum number of chunks in a single embedding request.
+            encoding_name: The tiktoken encoding of the embedding model.
+        """
+        if overlap_tokens >= chunk_tokens:
+            raise ValueError("overlap_tokens must be smaller than chunk_tokens.")
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+    def _split_with_counts(self, document):
+        tokens = self.encoding.encode(document.page_content, disallowed_special=())
+        if not tokens:
+            return
+        step = self.chunk_tokens - self.overlap_tokens
+        # Stop once the remaining tokens are already covered by the previous chunk's window
+        starts = range(0, max(len(tokens) - self.overlap_tokens, 1), step)
+        for chunk_number, start in enumerate(starts):
+            chunk_tokens = tokens[start : start + self.chunk_tokens]
+            chunk = Document(
+                page_content=self.encoding.decode(chunk_tokens),
+                metadata={**document.metadata, "chunk": chunk_number},
+            )
+            yield chunk, len(chunk_tokens)
+
+    def split(self, document):
+        """Yields the chunks of a single document."""
+        for chunk, _ in self._split_with_counts(document):
+            yield chunk
+
+    def stream_batches(self, documents):
+        """
+        The function `stream_batches` chunks a stream of documents and packs the chunks into
+        embedding batches.
+
+        Args:
+          documents: Any iterable of LangChain `Document` objects, e.g. a generator over PDF pages.
+
+        Returns:
+          A generator of lists of chunk `Document` objects. Each list stays within
+        `max_batch_tokens` tokens and `max_batch_size` chunks.
+        """
+        batch = []
+        batch_tokens = 0
+        for document in documents:
+            for chunk, n_tokens in self._split_with_counts(document):
+                if batch and (
+                    batch_tokens + n_tokens > self.max_batch_tokens
+                    or len(batch) >= self.max_batch_size
+                ):
+                    yield batch
+                    batch = []
+                    batch_tokens = 0
+                batch.append(chunk)
+                batch_tokens += n_tokens
+        if batch:
+            yield batch
+
+    def rebatch(self, document_batches):
+        """Like `stream_batches`, but takes an iterable of document lists."""
+        return self.stream_batches(chain.from_iterable(document_batches))
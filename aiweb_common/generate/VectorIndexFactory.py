@@ -0,0 +1,298 @@
+import math
+import threading
+import time
+
+import faiss
+import numpy as np
+import pandas as pd
+
+from aiweb_common.ObjectFactory import ObjectFactory
+
+# Index types whose coarse quantizer/codebooks must be trained on a sample before adding vectors
+TRAINED_INDEX_TYPES = {"ivf", "pq", "ivf_float16"}
+
+# Filters selecting at most this many vectors of an approximate index are searched exactly
+EXACT_FILTER_MAX_IDS = 10_000
+
+_direct_map_lock = threading.Lock()
+
+
+def _auto_nlist(n_training):
+    # ~4*sqrt(n) lists, while keeping the FAISS-recommended >= 39 training points per list
+    return max(1, min(int(4 * math.sqrt(n_training)), n_training // 39))
+
+
+def _flat_builder(dimension, **_ignored):
+    return faiss.IndexFlatL2(dimension)
+
+
+def _ivf_builder(dimension, n_training, nlist=None, **_ignored):
+    nlist = nlist or _auto_nlist(n_training)
+    return faiss.index_factory(dimension, f"IVF{nlist},Flat")
+
+
+def _hnsw_builder(dimension, hnsw_m=32, ef_construction=40, **_ignored):
+    index = faiss.IndexHNSWFlat(dimension, hnsw_m)
+    index.hnsw.efConstruction = ef_construction
+    return index
+
+
+def _pq_builder(dimension, n_training, nlist=None, pq_m=16, pq_bits=8, **_ignored):
+    if dimension % pq_m != 0:
+        raise ValueError(
+            f"Embedding dimension {dimension} is not divisible by pq_m={pq_m}. Choose another pq_m."
+        )
+    nlist = nlist or _auto_nlist(n_training)
+    return faiss.index_factory(dimension, f"IVF{nlist},PQ{pq_m}x{pq_bits}")
+
+
+def _float16_builder(dimension, **_ignored):
+    return faiss.IndexScalarQuantizer(dimension, faiss.ScalarQuantizer.QT_fp16)
+
+
+def _ivf_float16_builder(dimension, n_training, nlist=None, **_ignored):
+    nlist = nlist or _auto_nlist(n_training)
+    return faiss.index_factory(dimension, f"IVF{nlist},SQfp16")
+
+
+vector_index_factory = ObjectFactory()
+vector_index_factory.register_builder("flat", _flat_builder)
+vector_index_factory.register_builder("ivf", _ivf_builder)
+vector_index_factory.register_builder("hnsw", _hnsw_builder)
+vector_index_factory.register_builder("pq", _pq_builder)
+vector_index_factory.register_builder("float16", _float16_builder)
+vector_index_factory.register_builder("ivf_float16", _ivf_float16_builder)
+
+
+def select_training_sample(vectors, sample_size, seed=0):
+    """
+    The function `select_training_sample` picks a uniform random sample of rows to train an index on.
+
+    Args:
+      vectors: A float32 matrix of embeddings, one row per document.
+      sample_size: The maximum number of rows to return.
+      seed: Seed for the random generator so repeated builds produce the same index.
+
+    Returns:
+      The sampled rows, or `vectors` unchanged if it already has at most `sample_size` rows.
+    """
+    if len(vectors) <= sample_size:
+        return vectors
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(vectors), size=sample_size, replace=False)
+    return vectors[np.sort(rows)]
+
+
+def create_index(index_type, training_vectors, training_sample_size=100_000, seed=0, **params):
+    """
+    The function `create_index` builds an empty FAISS index of the requested type and trains it on
+    a sample of `training_vectors` when the index type needs training.
+
+    Args:
+      index_type: One of "flat", "ivf", "hnsw", "pq", "float16" or "ivf_float16".
+      training_vectors: A float32 matrix of embeddings to train on (also gives the dimension).
+      training_sample_size: Maximum number of vectors used for training.
+      seed: Seed used when sampling the training vectors.
+      **params: Builder options such as `nlist`, `hnsw_m`, `ef_construction`, `pq_m`, `pq_bits`.
+
+    Returns:
+      An empty, trained FAISS index ready for `add`.
+    """
+    training_vectors = np.ascontiguousarray(training_vectors, dtype=np.float32)
+    sample = select_training_sample(training_vectors, training_sample_size, seed)
+    index = vector_index_factory.create(
+        index_type, dimension=sample.shape[1], n_training=len(sample), **params
+    )
+    if not index.is_trained:
+        index.train(sample)
+    return index
+
+
+def tune_index(index, nprobe=None, ef_search=None):
+    """
+    The function `tune_index` sets query-time search parameters on a loaded index. Parameters that
+    do not apply to the index type (e.g. `nprobe` on a flat index) are ignored.
+
+    Args:
+      index: The FAISS index, e.g. `vectordb.index` of a LangChain FAISS vectorstore.
+      nprobe: Number of inverted lists an IVF index visits per query.
+      ef_search: Size of the HNSW candidate list per query.
+    """
+    parameter_space = faiss.ParameterSpace()
+    if nprobe is not None and faiss.try_extract_index_ivf(index) is not None:
+        parameter_space.set_index_parameter(index, "nprobe", nprobe)
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        parameter_space.set_index_parameter(index, "efSearch", ef_search)
+    return index
+
+
+def search_parameters(index, selector, nprobe=None, ef_search=None):
+    """
+    The function `search_parameters` builds per-query FAISS search parameters that restrict a
+    search to the ids accepted by `selector`. Per-query parameters replace the index-level ones,
+    so `nprobe`/`efSearch` default to the values currently set on the index.
+
+    Args:
+      index: The FAISS index that will be searched.
+      selector: A FAISS `IDSelector`, e.g. `faiss.IDSelectorBatch`.
+      nprobe: Optional override of the IVF `nprobe`.
+      ef_search: Optional override of the HNSW `efSearch`.
+
+    Returns:
+      A `SearchParameters` object of the right subclass for the index type.
+    """
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe or ivf_index.nprobe)
+    if isinstance(index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search or index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+
+def _is_approximate(index):
+    return faiss.try_extract_index_ivf(index) is not None or isinstance(index, faiss.IndexHNSW)
+
+
+def _reconstruct(index, ids):
+    # IVF indexes can only reconstruct vectors by id once they have a direct map
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None and ivf_index.direct_map.type == faiss.DirectMap.NoMap:
+        with _direct_map_lock:
+            if ivf_index.direct_map.type == faiss.DirectMap.NoMap:
+                ivf_index.make_direct_map()
+    return index.reconstruct_batch(ids)
+
+
+def _exact_subset_search(index, queries, k, ids):
+    subset = faiss.IndexFlat(index.d, index.metric_type)
+    subset.add(_reconstruct(index, ids))
+    scores, positions = subset.search(queries, k)
+    return scores, np.where(positions >= 0, ids[np.maximum(positions, 0)], -1)
+
+
+def filtered_search(
+    index, queries, k, ids, nprobe=None, ef_search=None, exact_max_ids=EXACT_FILTER_MAX_IDS
+):
+    """
+    The function `filtered_search` searches only the vectors whose ids are in `ids`, and returns
+    min(k, len(ids)) results per query like an exact search would.
+
+    Flat and float16 indexes scan every vector, so an ID selector restricts them exactly. IVF and
+    HNSW indexes only see the selected vectors inside the lists they probe or the neighbourhood
+    they visit, so a selective filter can leave them with few or no hits. For those, small
+    selections (at most `exact_max_ids` ids) are searched exactly over the reconstructed vectors.
+    Larger ones are searched with `nprobe`/`efSearch` raised in proportion to the filter's
+    selectivity, and any query still short of results is searched exactly.
+
+    Args:
+      index: The FAISS index to search.
+      queries: A float32 matrix of query vectors.
+      k: The number of results per query.
+      ids: The vector ids to search, e.g. from `MetadataFilterIndex.select`.
+      nprobe: Optional IVF `nprobe` before scaling; defaults to the index's.
+      ef_search: Optional HNSW `efSearch` before scaling; defaults to the index's.
+      exact_max_ids: Largest selection searched exactly on approximate indexes.
+
+    Returns:
+      A tuple (scores, indices) shaped like the result of `index.search`, padded with -1 ids.
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) == 0:
+        return (
+            np.full((len(queries), k), np.inf, dtype=np.float32),
+            np.full((len(queries), k), -1, dtype=np.int64),
+        )
+    approximate = _is_approximate(index)
+    if approximate and len(ids) <= exact_max_ids:
+        return _exact_subset_search(index, queries, k, ids)
+
+    if approximate:
+        selectivity = len(ids) / max(index.ntotal, 1)
+        ivf_index = faiss.try_extract_index_ivf(index)
+        if ivf_index is not None:
+            nprobe = min(ivf_index.nlist, math.ceil((nprobe or ivf_index.nprobe) / selectivity))
+        else:
+            ef_search = min(
+                index.ntotal,
+                max(k, math.ceil((ef_search or index.hnsw.efSearch) / selectivity)),
+            )
+    params = search_parameters(index, faiss.IDSelectorBatch(ids), nprobe, ef_search)
+    scores, indices = index.search(queries, k, params=params)
+
+    if approximate:
+        short = (indices >= 0).sum(axis=1) < min(k, len(ids))
+        if short.any():
+            scores[short], indices[short] = _exact_subset_search(index, queries[short], k, ids)
+    return scores, indices
+
+
+def benchmark_index_types(
+    index_configs=None,
+    n_vectors=50_000,
+    dimension=256,
+    n_queries=500,
+    k=10,
+    seed=0,
+):
+    """
+    The function `benchmark_index_types` measures recall@k and per-query latency of each index
+    configuration against an exact flat index on a synthetic, clustered corpus.
+
+    Args:
+      index_configs: A dict mapping a label to a dict with an "index_type" key plus builder and
+    `tune_index` options. Defaults to a small sweep over the supported index types.
+      n_vectors: Size of the synthetic corpus.
+      dimension: Dimension of the synthetic vectors.
+      n_queries: Number of queries to time.
+      k: Number of neighbours retrieved per query.
+      seed: Seed for the synthetic data.
+
+    Returns:
+      A DataFrame with one row per configuration: recall@k, milliseconds per query and index size.
+    """
+    if index_configs is None:
+        index_configs = {
+            "ivf nprobe=8": {"index_type": "ivf", "nprobe": 8},
+            "ivf nprobe=32": {"index_type": "ivf", "nprobe": 32},
+            "hnsw efSearch=64": {"index_type": "hnsw", "ef_search": 64},
+            "pq nprobe=32": {"index_type": "pq", "nprobe": 32},
+            "float16": {"index_type": "float16"},
+        }
+
+    # Gaussian clusters roughly mimic the topical structure of embedded documents
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n_vectors // 500), dimension)).astype(np.float32)
+    corpus = centers[rng.integers(len(centers), size=n_vectors)]
+    corpus += rng.normal(scale=0.3, size=corpus.shape).astype(np.float32)
+    queries = corpus[rng.choice(n_vectors, size=n_queries, replace=False)]
+    queries = queries + rng.normal(scale=0.1, size=queries.shape).astype(np.float32)
+
+    def run(index):
+        start = time.perf_counter()
+        _, neighbours = index.search(queries, k)
+        elapsed = time.perf_counter() - start
+        return neighbours, 1000 * elapsed / n_queries, len(faiss.serialize_index(index))
+
+    baseline = create_index("flat", corpus)
+    baseline.add(corpus)
+    truth, baseline_ms, baseline_bytes = run(baseline)
+
+    rows = [{"index": "flat", "recall@k": 1.0, "ms/query": baseline_ms, "bytes": baseline_bytes}]
+    for label, config in index_configs.items():
+        config = dict(config)
+        index_type = config.pop("index_type")
+        nprobe = config.pop("nprobe", None)
+        ef_search = config.pop("ef_search", None)
+        index = create_index(index_type, corpus, seed=seed, **config)
+        index.add(corpus)
+        tune_index(index, nprobe=nprobe, ef_search=ef_search)
+        neighbours, ms_per_query, size = run(index)
+        recall = np.mean(
+            [len(set(found) & set(expected)) / k for found, expected in zip(neighbours, truth)]
+        )
+        rows.append({"index": label, "recall@k": recall, "ms/query": ms_per_query, "bytes": size})
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    print(benchmark_index_types().to_string(index=False))
@@ -3,10 +3,13 @@ from .AugmentedResponse import (
     RAGResponseHandler,
     SearchResponseHandler,
 )
-from .AugmentedServicer import RAGServicer, SearchServicer
+from .AugmentedServicer import FanOutResult, RAGServicer, SearchServicer
 from .ChatResponse import ChatResponseHandler
 from .ChatSchemas import AIName, ChatRequest, ChatResponse, Message, Role
 from .ChatServicer import ChatServicer
+from .CoalescingEmbeddings import CoalescingEmbeddings
+from .MetadataFilterIndex import MetadataFilterIndex
+from .NearDuplicateFilter import NearDuplicateFilter
 from .PromptAssembler import PromptAssembler
 from .PromptyResponse import PromptyResponseHandler
 from .PromptyServicer import PromptyServicer
@@ -14,3 +17,4 @@ from .QueryInterface import QueryInterface
 from .Response import ResponseHandler
 from .SingleResponse import SingleResponseHandler
 from .SingleResponseServicer import SingleResponseServicer
+from .TokenChunker import TokenChunker
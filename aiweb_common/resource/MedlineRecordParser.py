@@ -0,0 +1,151 @@
+import pandas as pd
+import pyarrow as pa
+from Bio import Medline
+
+# Columns produced for every article, in DataFrame order
+MEDLINE_COLUMNS = [
+    "date_published",
+    "title",
+    "keywords",
+    "abstract",
+    "pmid",
+    "authors",
+    "journal",
+    "citation",
+]
+
+
+def _format_author(author):
+    *last_name, initials = author.rsplit(" ", 1)
+    return f"{' '.join(last_name)}, {initials}."
+
+
+def format_authors(authors):
+    """
+    The function `format_authors` takes a list of strings representing authors and returns a
+    formatted string of their last names followed by initials, following APA rules.
+
+    Args:
+      authors: A list of strings, where each string represents an author in the format
+    "Last Name Initials".
+
+    Returns:
+      A formatted string of authors' names in the format "Last Name, Initials.". More than 20
+    authors are shortened to the first 19, an ellipsis and the last author.
+    """
+    if len(authors) <= 20:
+        return ", ".join(_format_author(author) for author in authors)
+    formatted_authors = [_format_author(author) for author in authors[:19]]
+    formatted_authors.append("…")
+    formatted_authors.append(_format_author(authors[-1]))
+    return ", ".join(formatted_authors)
+
+
+def parse_medline_record(record):
+    """
+    The function `parse_medline_record` extracts the fields we use from a MEDLINE record, without
+    keeping any state between records, so it is safe to call from several threads.
+
+    Args:
+      record: A `Bio.Medline.Record` (or any dict keyed by MEDLINE tags).
+
+    Returns:
+      A dict with the `MEDLINE_COLUMNS` keys, including a formatted APA citation.
+    """
+    keywords = record.get("OT", [])  # OT might not be present in all records
+    # try to use mesh headers if keywords not present
+    if not keywords:
+        keywords = record.get("MH", [])
+    fields = {
+        "date_published": record.get("DP", "No date available"),
+        "title": record.get("TI", "No title available"),
+        "keywords": keywords,
+        "abstract": record.get("AB", "No abstract available"),
+        "pmid": record.get("PMID", "No PMID available"),
+        "authors": record.get("AU", []),
+        "journal": record.get("JT", "No jounral name available"),
+    }
+    volume = record.get("VI", "No volume available")
+    pages = record.get("PG", "No pages available")
+    fields["citation"] = (
+        f"{format_authors(fields['authors'])} ({fields['date_published']}). {fields['title']} "
+        f"{fields['journal']}, {volume}, {pages}. PMID: {fields['pmid']}"
+    )
+    return fields
+
+
+class MedlineColumnBuilder:
+    """
+    The `MedlineColumnBuilder` class accumulates parsed MEDLINE records column by column as they
+    are read from an efetch response, and turns them into a DataFrame or an Arrow table at the end.
+    Each builder is independent, so concurrent fetches can each fill their own and be combined
+    with `extend`.
+    """
+
+    def __init__(self):
+        self.columns = {column: [] for column in MEDLINE_COLUMNS}
+
+    def __len__(self):
+        return len(self.columns["pmid"])
+
+    def append(self, record):
+        for column, value in parse_medline_record(record).items():
+            self.columns[column].append(value)
+
+    def extend(self, other):
+        """Appends the rows of another builder."""
+        for column, values in other.columns.items():
+            self.columns[column].extend(values)
+
+    def _ordered_columns(self, order):
+        if order is None:
+            return self.columns
+        # Rows follow `order` (a list of PMIDs); duplicates and unknown PMIDs are dropped
+        first_row = {}
+        for row, pmid in enumerate(self.columns["pmid"]):
+            first_row.setdefault(str(pmid), row)
+        rows = [first_row[pmid] for pmid in dict.fromkeys(map(str, order)) if pmid in first_row]
+        return {column: [values[row] for row in rows] for column, values in self.columns.items()}
+
+    def to_dataframe(self, order=None):
+        """
+        Args:
+          order: Optional list of PMIDs giving the row order of the result.
+
+        Returns:
+          A DataFrame with the `MEDLINE_COLUMNS` columns.
+        """
+        return pd.DataFrame(self._ordered_columns(order), columns=MEDLINE_COLUMNS)
+
+    def to_arrow(self, order=None):
+        """Like `to_dataframe`, but returns a typed `pyarrow.Table`."""
+        schema = pa.schema(
+            [
+                (
+                    column,
+                    pa.list_(pa.string()) if column in ("keywords", "authors") else pa.string(),
+                )
+                for column in MEDLINE_COLUMNS
+            ]
+        )
+        return pa.table(self._ordered_columns(order), schema=schema)
+
+
+def parse_medline_stream(handle, raw_records=None):
+    """
+    The function `parse_medline_stream` parses a MEDLINE text response record by record while it
+    is being read, straight into a `MedlineColumnBuilder`.
+
+    Args:
+      handle: A text handle such as the one returned by `Entrez.efetch(rettype="medline")`.
+      raw_records: Optional list that the raw records are also appended to (e.g. for caching).
+
+    Returns:
+      The filled `MedlineColumnBuilder`.
+    """
+    builder = MedlineColumnBuilder()
+    for record in Medline.parse(handle):
+        builder.append(record)
+        if raw_records is not None:
+            raw_records.append(record)
+    return builder
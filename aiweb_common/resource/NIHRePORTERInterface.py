@@ -1,18 +1,129 @@
 import csv
 import json
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
+from requests.adapters import HTTPAdapter
 
 from aiweb_common.resource import default_resource_config
+from aiweb_common.resource.rate_limiting import RateLimiter, backoff_delay
+
+# RePORTER refuses offsets past this, so one criteria set can only page through this many records
+NIH_REPORTER_RECORD_LIMIT = 15_000
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Free-text columns of the Parquet/Arrow output
+NIH_REPORTER_TEXT_COLUMNS = ["pi", "org_name", "title", "abstract", "phr"]
+
+
+def _reporter_schema():
+    return pa.schema(
+        [("appl_id", pa.int64())] + [(column, pa.string()) for column in NIH_REPORTER_TEXT_COLUMNS]
+    )
+
+
+def _results_frame(results):
+    """
+    Turns a page of RePORTER results into a DataFrame with the Parquet/Arrow output columns. Text
+    is kept at full length; only missing values, double quotes and newlines are normalized, one
+    vectorized pass per column.
+    """
+    frame = pd.DataFrame(
+        {
+            "appl_id": pd.array([result.get("appl_id") for result in results], dtype="Int64"),
+            "pi": [result.get("contact_pi_name") for result in results],
+            "org_name": [(result.get("organization") or {}).get("org_name") for result in results],
+            "title": [result.get("project_title") for result in results],
+            "abstract": [result.get("abstract_text") for result in results],
+            "phr": [result.get("phr_text") for result in results],
+        }
+    )
+    for column in NIH_REPORTER_TEXT_COLUMNS:
+        frame[column] = (
+            frame[column]
+            .fillna("")
+            .astype(str)
+            .str.replace('"', "'", regex=False)
+            .str.replace(r"[\r\n]+", " ", regex=True)
+        )
+    return frame
+
+
+def _split_criteria(criteria):
+    """
+    Splits a RePORTER criteria set into partitions that together cover it: first one per fiscal
+    year, then one per agency, then one per activity code. Returns None once no split is left.
+    """
+    if len(criteria.get("fiscal_years", [])) > 1:
+        return [{**criteria, "fiscal_years": [year]} for year in criteria["fiscal_years"]]
+    if "agencies" not in criteria:
+        return [
+            {**criteria, "agencies": [agency]}
+            for agency in default_resource_config.NIH_PARTITION_AGENCIES
+        ]
+    if "activity_codes" not in criteria:
+        return [
+            {**criteria, "activity_codes": [activity_code]}
+            for activity_code in default_resource_config.NIH_PARTITION_ACTIVITY_CODES
+        ]
+    return None
+
+
+def _record_partition_total(split, total):
+    # Agency and activity code lists are not guaranteed to be exhaustive, so report any shortfall
+    split["covered"] += total
+    split["remaining"] -= 1
+    if split["remaining"] == 0 and split["covered"] < split["total"]:
+        print(
+            f"Partitions of RePORTER search {json.dumps(split['criteria'])} cover "
+            f"{split['covered']} of its {split['total']} projects."
+        )
 
 
 class NIHRePORTERAPI:
-    def __init__(self, request_api_url, request_headers, request_data, request_timeout):
+    def __init__(
+        self,
+        request_api_url,
+        request_headers,
+        request_data,
+        request_timeout,
+        rate_per_second=1,
+        max_workers=4,
+        max_retries=3,
+        delay_seconds=2,
+    ):
+        """
+        Args:
+            request_api_url: The RePORTER projects search endpoint.
+            request_headers: Headers sent with every request.
+            request_data: Default request body, used when no payload is given.
+            request_timeout: Timeout in seconds of a single request.
+            rate_per_second: Maximum requests started per second, shared by every instance
+                using the same endpoint. RePORTER asks for no more than one per second.
+            max_workers: Number of pages requested concurrently.
+            max_retries: Number of retries after a failed request.
+            delay_seconds: Scale of the jittered exponential backoff between retries.
+        """
         self.request_api_url = request_api_url
         self.request_headers = request_headers
         self.request_data = request_data
         self.request_timeout = request_timeout
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.delay_seconds = delay_seconds
+        self.rate_limiter = RateLimiter.shared(f"nih_reporter:{request_api_url}", rate_per_second)
+        # One pooled session, so concurrent pages reuse their connections
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=max_workers))
+        self.session.headers.update(request_headers)
 
     def _sanitize_field(self, field, field_name, max_length=5000):
         if field is not None and len(field) <= max_length:
@@ -27,14 +138,183 @@ class NIHRePORTERAPI:
         return field
 
     # Make the request
-    def _make_nih_reporter_request(self):
-        response = requests.post(
-            self.request_api_url,
-            headers=self.request_headers,
-            data=self.request_data,
-            timeout=self.request_timeout,
-        )
-        return response
+    def _make_nih_reporter_request(self, payload=None):
+        """
+        Posts `payload` as JSON (or the constructor's `request_data` if no payload is given) under
+        the shared rate limiter. Connection errors, timeouts and 429/5xx responses are retried with
+        jittered exponential backoff; the last error is raised once the retries are used up.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                if payload is None:
+                    response = self.session.post(
+                        self.request_api_url, data=self.request_data, timeout=self.request_timeout
+                    )
+                else:
+                    response = self.session.post(
+                        self.request_api_url, json=payload, timeout=self.request_timeout
+                    )
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(
+                    f"RePORTER returned {response.status_code}", response=response
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            if attempt == self.max_retries:
+                raise error
+            delay = backoff_delay(attempt, self.delay_seconds)
+            print(f"RePORTER request failed ({error}), retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+
+    def _fetch_page(self, criteria, offset, limit):
+        payload = {
+            "criteria": criteria,
+            "include_fields": default_resource_config.NIH_INCLUDE_FIELDS,
+            "offset": offset,
+            "limit": limit,
+        }
+        data = self._make_nih_reporter_request(payload).json()
+        # RePORTER answers past-the-end pages with a bare error message
+        if isinstance(data, list) and len(data) == 1 and "exceeded total records count" in data[0]:
+            return {"meta": {"total": 0}, "results": []}
+        return data
+
+    def _iter_pages(self, criteria_sets, limit, checkpoint=None):
+        """
+        Yields the results of every page of every criteria set, as the pages arrive. The first
+        page of each set gives its total, after which the remaining offsets are fetched
+        concurrently, `max_workers` at a time, with at most twice that many pages requested ahead
+        of the caller. If a page fails or the caller stops iterating, queued pages are cancelled
+        rather than fetched. Sets over the 15,000-record paging cap are split
+        (see `_split_criteria`) and their partitions fetched instead, in parallel. Projects are
+        deduplicated by application id.
+
+        With a `checkpoint` (an `NIHRePORTERStore`), totals and pages are recorded as they are
+        processed, and pages recorded by an interrupted run are not fetched again.
+        """
+        seen_appl_ids = set()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        max_in_flight = self.max_workers * 2
+        try:
+            pending = {}
+            queued = deque()
+
+            def submit(criteria, offset, split=None, first_page=False):
+                page = (criteria, offset, split, first_page)
+                # First pages go ahead of queued offsets, so totals and splits are known early
+                if first_page:
+                    queued.appendleft(page)
+                else:
+                    queued.append(page)
+
+            def fill():
+                while queued and len(pending) < max_in_flight:
+                    page = queued.popleft()
+                    future = executor.submit(self._fetch_page, page[0], page[1], limit)
+                    pending[future] = page
+
+            def schedule(criteria, total, split, fetched_offset=None):
+                # Returns False when the criteria set is split, so its own pages are not used
+                if checkpoint is not None:
+                    checkpoint.set_partition_total(criteria, total)
+                if split is not None:
+                    _record_partition_total(split, total)
+                partitions = (
+                    _split_criteria(criteria) if total > NIH_REPORTER_RECORD_LIMIT else None
+                )
+                if partitions:
+                    split = {
+                        "criteria": criteria,
+                        "total": total,
+                        "remaining": len(partitions),
+                        "covered": 0,
+                    }
+                    for partition in partitions:
+                        start(partition, split)
+                    return False
+                if total > NIH_REPORTER_RECORD_LIMIT:
+                    print(
+                        f"RePORTER search {json.dumps(criteria)} has {total} projects and "
+                        f"cannot be split further; only the first "
+                        f"{NIH_REPORTER_RECORD_LIMIT} are fetched."
+                    )
+                completed = checkpoint.completed_pages(criteria) if checkpoint is not None else ()
+                for offset in range(0, min(total, NIH_REPORTER_RECORD_LIMIT), limit):
+                    if offset != fetched_offset and offset not in completed:
+                        submit(criteria, offset)
+                return True
+
+            def start(criteria, split=None):
+                total = checkpoint.partition_total(criteria) if checkpoint is not None else None
+                if total is None:
+                    submit(criteria, 0, split, first_page=True)
+                else:
+                    schedule(criteria, total, split)
+
+            for criteria in criteria_sets:
+                start(criteria)
+            fill()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    criteria, offset, split, first_page = pending.pop(future)
+                    data = future.result()
+                    if first_page and not schedule(
+                        criteria, data["meta"]["total"], split, fetched_offset=offset
+                    ):
+                        # The partitions fetch these records again, so this page is dropped
+                        fill()
+                        continue
+
+                    results = []
+                    for result in data["results"]:
+                        appl_id = result.get("appl_id")
+                        if appl_id is not None:
+                            if appl_id in seen_appl_ids:
+                                continue
+                            seen_appl_ids.add(appl_id)
+                        results.append(result)
+                    yield results
+                    # Only recorded once the caller has processed the page
+                    if checkpoint is not None:
+                        checkpoint.complete_page(criteria, offset)
+                fill()
+        finally:
+            # Do not wait for (or send) queued pages after an error or an early stop
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _department_criteria(self, departments, fiscals_years, include_current_year=False):
+        if departments == []:
+            raise AttributeError(
+                "No departments selected, configure departments variable and try again"
+            )
+
+        # Get the current year
+        current_year = datetime.now().year
+        last_year = current_year + 1 if include_current_year else current_year
+        return [
+            {
+                "fiscal_years": list(range(current_year - (fiscals_years - 1), last_year)),
+                "dept_types": [department],
+                "award_type": "1",
+                "use_relevance": True,
+                "include_active_projects": True,
+            }
+            for department in departments
+        ]
+
+    def _result_row(self, result):
+        organization = result.get("organization") or {}
+        return [
+            self._sanitize_field(result.get("contact_pi_name"), "contact_pi_name"),
+            self._sanitize_field(organization.get("org_name"), "org_name"),
+            self._sanitize_field(result.get("project_title"), "project_title"),
+            self._sanitize_field(result.get("abstract_text"), "abstract_text"),
+            self._sanitize_field(result.get("phr_text"), "phr_text"),
+        ]
 
     def scrape_nih_reporter(
         self,
@@ -44,97 +324,140 @@ class NIHRePORTERAPI:
         departments=default_resource_config.NIH_DEPARTMENTS,
         limit=500,
     ):
+        """
+        The function `scrape_nih_reporter` downloads the projects of each department over the last
+        fiscal years and writes them to a CSV file. Department pages are requested concurrently
+        under the configured rate limit, and rows are written in the order pages arrive.
+        Departments with more projects than RePORTER pages through (15,000) are split into
+        smaller searches, so they are no longer truncated; see `_iter_pages`.
+
+        Args:
+          filename: Path of the CSV file to write.
+          csv_headers: Header row of the CSV file.
+          fiscals_years: Number of fiscal years to search, counting back from the current year.
+          departments: RePORTER department types, searched separately.
+          limit: Number of projects per page (at most 500).
+        """
+        criteria_sets = self._department_criteria(departments, fiscals_years)
+
         # Open the CSV file for writing
         with open(filename, "w", newline="") as f:
             writer = csv.writer(f, quoting=csv.QUOTE_ALL)
 
             # Write the headers
             writer.writerow(csv_headers)
+            for results in self._iter_pages(criteria_sets, limit):
+                writer.writerows(self._result_row(result) for result in results)
 
-            # Get the current year
-            current_year = datetime.now().year
-            if departments == []:
-                AttributeError(
-                    "No departments selected, configure departments variable and try again"
+    def iter_record_batches(
+        self,
+        fiscals_years=5,
+        departments=default_resource_config.NIH_DEPARTMENTS,
+        limit=500,
+    ):
+        """
+        The function `iter_record_batches` streams the projects of each department as typed Arrow
+        record batches, one per RePORTER page, with the columns appl_id, pi, org_name, title,
+        abstract and phr. Unlike the CSV output, long abstracts are kept in full.
+
+        Args:
+          fiscals_years: Number of fiscal years to search, counting back from the current year.
+          departments: RePORTER department types, searched separately.
+          limit: Number of projects per page (at most 500).
+
+        Returns:
+          A generator of `pyarrow.RecordBatch` objects.
+        """
+        schema = _reporter_schema()
+        criteria_sets = self._department_criteria(departments, fiscals_years)
+        for results in self._iter_pages(criteria_sets, limit):
+            if results:
+                yield pa.RecordBatch.from_pandas(
+                    _results_frame(results), schema=schema, preserve_index=False
                 )
-            else:
-                for department in departments:
-                    offset = 0
-                    while offset <= 14999:  # api limit
-                        # Define the payload
-                        payload = {
-                            "criteria": {
-                                "fiscal_years": list(
-                                    range(current_year - (fiscals_years - 1), current_year)
-                                ),
-                                "dept_types": [department],
-                                "award_type": "1",
-                                "use_relevance": True,
-                                "include_active_projects": True,
-                            },
-                            "include_fields": default_resource_config.NIH_INCLUDE_FIELDS,
-                            "offset": offset,
-                            "limit": limit,
-                        }
-
-                        # Convert the payload to JSON format
-                        # payload_json = json.dumps(payload)
-
-                        # Make the request
-                        response = self._make_nih_reporter_request()
-                        data = response.json()
-
-                        # If no results, break the loop
-                        if (
-                            isinstance(data, list)
-                            and len(data) == 1
-                            and "exceeded total records count" in data[0]
-                        ):
-                            break
-
-                        # Loop through each result
-                        for result in data["results"]:
-                            # Use try-except block for each attribute
-
-                            try:
-                                pi = self._sanitize_field(
-                                    result.get("contact_pi_name"), "contact_pi_name"
-                                )
-                            except AttributeError:
-                                pi = ""
-
-                            try:
-                                org_name = self._sanitize_field(
-                                    result["organization"].get("org_name"), "org_name"
-                                )
-                            except AttributeError:
-                                org_name = ""
-
-                            try:
-                                title = self._sanitize_field(
-                                    result.get("project_title"), "project_title"
-                                )
-                            except AttributeError:
-                                title = ""
-
-                            try:
-                                abstract = self._sanitize_field(
-                                    result.get("abstract_text"), "abstract_text"
-                                )
-                                if abstract is not None:
-                                    abstract = abstract.replace("\n", " ")
-                            except AttributeError:
-                                abstract = ""
-
-                            try:
-                                phr = self._sanitize_field(result.get("phr_text"), "phr_text")
-                                if phr is not None:
-                                    phr = phr.replace("\n", " ")
-                            except AttributeError:
-                                phr = ""
-
-                            # Write the row
-                            writer.writerow([pi, org_name, title, abstract, phr])
-
-                        # Increase the offset by limit
-                        offset += limit
+
+    def scrape_nih_reporter_parquet(
+        self,
+        filename,
+        fiscals_years=5,
+        departments=default_resource_config.NIH_DEPARTMENTS,
+        limit=500,
+    ):
+        """
+        The function `scrape_nih_reporter_parquet` writes the record batches of
+        `iter_record_batches` to a Parquet file as they arrive, so the download never has to fit
+        in memory and the result can be read straight into pandas, Arrow or
+        `VectorStoreBuilder.convert_parquet_to_vectorstore`.
+
+        Args:
+          filename: Path of the Parquet file to write.
+          fiscals_years: Number of fiscal years to search, counting back from the current year.
+          departments: RePORTER department types, searched separately.
+          limit: Number of projects per page (at most 500).
+
+        Returns:
+          The number of projects written.
+        """
+        written = 0
+        with pq.ParquetWriter(filename, _reporter_schema()) as writer:
+            for batch in self.iter_record_batches(fiscals_years, departments, limit):
+                writer.write_batch(batch)
+                written += batch.num_rows
+        return written
+
+    def sync_nih_reporter(
+        self,
+        store,
+        fiscals_years=5,
+        departments=default_resource_config.NIH_DEPARTMENTS,
+        limit=500,
+        incremental=False,
+    ):
+        """
+        The function `sync_nih_reporter` downloads the projects of each department into a local
+        `NIHRePORTERStore`, upserting them by application id. Progress is checkpointed per page,
+        so a sync that dies partway resumes where it stopped when called again with the same
+        arguments.
+
+        Args:
+          store: The `NIHRePORTERStore` to update.
+          fiscals_years: Number of fiscal years to search, counting back from and including the
+        current fiscal year, where new awards appear (the scrape functions leave it out).
+          departments: RePORTER department types, searched separately.
+          limit: Number of projects per page (at most 500).
+          incremental: Only fetch projects added to RePORTER since the last successful sync
+        (RePORTER's `date_added` criterion). Falls back to a full sync when the store has never
+        been synced.
+
+        Returns:
+          The number of projects written to the store.
+        """
+        request = {
+            "fiscals_years": fiscals_years,
+            "departments": list(departments),
+            "limit": limit,
+            "incremental": incremental,
+        }
+        run = store.pending_run()
+        if run is None or run["request"] != request:
+            criteria_sets = self._department_criteria(
+                departments, fiscals_years, include_current_year=True
+            )
+            today = datetime.now().strftime("%Y-%m-%d")
+            last_sync = store.get_meta("last_sync")
+            if incremental and last_sync is not None:
+                # Starting from the day of the last sync re-fetches a little, which upserts absorb
+                criteria_sets = [
+                    {**criteria, "date_added": {"from_date": last_sync, "to_date": today}}
+                    for criteria in criteria_sets
+                ]
+            run = {"request": request, "criteria_sets": criteria_sets, "started": today}
+            store.start_run(run)
+        else:
+            print(f"Resuming the RePORTER sync started on {run['started']}.")
+
+        written = 0
+        for results in self._iter_pages(run["criteria_sets"], limit, checkpoint=store):
+            written += store.upsert_projects(results)
+        store.finish_run(run["started"])
+        return written
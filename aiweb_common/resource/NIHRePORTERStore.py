@@ -0,0 +1,150 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+
+def _criteria_key(criteria):
+    return json.dumps(criteria, sort_keys=True)
+
+
+class NIHRePORTERStore:
+    """
+    The `NIHRePORTERStore` class is a local SQLite copy of RePORTER projects, kept up to date by
+    `NIHRePORTERAPI.sync_nih_reporter`. Projects are upserted by application id, so repeated and
+    incremental syncs never duplicate them.
+
+    The store also holds the checkpoints of the sync in progress: the total of every criteria set
+    (partition) seen so far and the pages already stored. An interrupted sync started again with
+    the same arguments resumes from them instead of starting over.
+    """
+
+    def __init__(self, db_path):
+        """
+        Args:
+            db_path: Path of the SQLite file; created if it does not exist.
+        """
+        self.db_path = Path(db_path)
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS projects (
+                    appl_id INTEGER PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    synced_at REAL NOT NULL
+                )
+                """)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS partitions (criteria TEXT PRIMARY KEY, total INTEGER)"
+            )
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    criteria TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    PRIMARY KEY (criteria, offset)
+                )
+                """)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def upsert_projects(self, results):
+        """
+        Inserts or replaces RePORTER results by `appl_id`. Results without an application id are
+        skipped. Returns the number of projects written.
+        """
+        rows = [
+            (result["appl_id"], json.dumps(result), time.time())
+            for result in results
+            if result.get("appl_id") is not None
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO projects VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def iter_projects(self):
+        """Yields every stored project as the dict RePORTER returned."""
+        with self._lock:
+            payloads = self._conn.execute(
+                "SELECT payload FROM projects ORDER BY appl_id"
+            ).fetchall()
+        for (payload,) in payloads:
+            yield json.loads(payload)
+
+    def to_dataframe(self):
+        """Returns the stored projects as a DataFrame, with nested fields flattened."""
+        return pd.json_normalize(list(self.iter_projects()))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def pending_run(self):
+        """Returns the sync in progress (as passed to `start_run`), or None."""
+        run = self.get_meta("pending_run")
+        return json.loads(run) if run is not None else None
+
+    def start_run(self, run):
+        """Discards the checkpoints of any earlier sync and records `run` as in progress."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM partitions")
+            self._conn.execute("DELETE FROM pages")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('pending_run', ?)", (json.dumps(run),)
+            )
+
+    def finish_run(self, synced_date):
+        """Clears the checkpoints and records `synced_date` as the last successful sync."""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM partitions")
+            self._conn.execute("DELETE FROM pages")
+            self._conn.execute("DELETE FROM meta WHERE key = 'pending_run'")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('last_sync', ?)", (synced_date,)
+            )
+
+    def partition_total(self, criteria):
+        """Returns the total recorded for a criteria set during this sync, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT total FROM partitions WHERE criteria = ?", (_criteria_key(criteria),)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def set_partition_total(self, criteria, total):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO partitions VALUES (?, ?)", (_criteria_key(criteria), total)
+            )
+
+    def completed_pages(self, criteria):
+        """Returns the offsets of the pages of a criteria set already stored during this sync."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT offset FROM pages WHERE criteria = ?", (_criteria_key(criteria),)
+            ).fetchall()
+        return {offset for (offset,) in rows}
+
+    def complete_page(self, criteria, offset):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO pages VALUES (?, ?)", (_criteria_key(criteria), offset)
+            )
+
+    def close(self):
+        self._conn.close()
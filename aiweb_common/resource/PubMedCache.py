@@ -0,0 +1,186 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+class PubMedRecordCache:
+    """
+    The `PubMedRecordCache` class is a local SQLite store placed in front of `PubMedInterface`. It
+    keeps fetched PubMed records keyed by PMID (one entry per format, e.g. "medline" or "xml") so
+    that popular articles are served without an NCBI round-trip, and caches `esearch` ID lists per
+    (query, max_results) for `search_ttl_seconds`.
+
+    The database file can be shared by several processes. Hit/miss counters are kept per instance
+    and reported by `stats()`; `prune()` evicts the least recently used records once the stored
+    payloads exceed `max_bytes`.
+    """
+
+    def __init__(self, db_path, search_ttl_seconds=24 * 60 * 60, max_bytes=None):
+        """
+        Args:
+            db_path: Path of the SQLite file; created if it does not exist.
+            search_ttl_seconds: How long a cached esearch ID list stays valid.
+            max_bytes: Optional size limit of the cached record payloads, enforced after writes.
+        """
+        self.db_path = Path(db_path)
+        self.search_ttl_seconds = search_ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.search_hits = 0
+        self.search_misses = 0
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS records (
+                    pmid TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (pmid, format)
+                )
+                """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS searches (
+                    query TEXT NOT NULL,
+                    max_results INTEGER NOT NULL,
+                    ids TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (query, max_results)
+                )
+                """)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+
+    def get_records(self, pmids, record_format):
+        """
+        The function `get_records` looks up cached records.
+
+        Args:
+          pmids: The PMIDs to look up.
+          record_format: The format the records were stored in, e.g. "medline" or "xml".
+
+        Returns:
+          A dict mapping each cached PMID to its stored payload. PMIDs that are not cached are
+        missing from the dict.
+        """
+        pmids = [str(pmid) for pmid in pmids]
+        found = {}
+        with self._lock, self._conn:
+            # Stay well below SQLite's limit on the number of bound parameters
+            for start in range(0, len(pmids), 500):
+                batch = pmids[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT pmid, payload FROM records WHERE format = ? AND pmid IN ({placeholders})",
+                    [record_format, *batch],
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._conn.executemany(
+                    "UPDATE records SET last_access = ? WHERE pmid = ? AND format = ?",
+                    [(time.time(), pmid, record_format) for pmid in found],
+                )
+            self.hits += len(found)
+            self.misses += len(set(pmids) - set(found))
+        return found
+
+    def put_records(self, payloads, record_format):
+        """Stores a dict mapping PMIDs to payload strings, then prunes if over `max_bytes`."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (str(pmid), record_format, payload, len(payload.encode("utf-8")), now, now)
+                    for pmid, payload in payloads.items()
+                ],
+            )
+        if self.max_bytes is not None:
+            self.prune(self.max_bytes)
+
+    def get_search(self, query, max_results):
+        """Returns the cached ID list of an esearch, or None if it is missing or expired."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT ids, fetched_at FROM searches WHERE query = ? AND max_results = ?",
+                (query, max_results),
+            ).fetchone()
+            if row is None or time.time() - row[1] > self.search_ttl_seconds:
+                self.search_misses += 1
+                return None
+            self.search_hits += 1
+        return json.loads(row[0])
+
+    def put_search(self, query, max_results, ids):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)",
+                (query, max_results, json.dumps(list(ids)), time.time()),
+            )
+
+    def get_meta(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_meta(self, key, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def size_bytes(self):
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM records").fetchone()[0]
+
+    def prune(self, max_bytes):
+        """
+        The function `prune` evicts the least recently used records until the stored payloads
+        take at most `max_bytes`, and drops expired searches.
+
+        Returns:
+          The number of records removed.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM searches WHERE fetched_at < ?",
+                (time.time() - self.search_ttl_seconds,),
+            )
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM records").fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            evict = []
+            rows = self._conn.execute(
+                "SELECT pmid, format, size FROM records ORDER BY last_access ASC"
+            )
+            for pmid, record_format, size in rows:
+                if total <= max_bytes:
+                    break
+                evict.append((pmid, record_format))
+                total -= size
+            self._conn.executemany("DELETE FROM records WHERE pmid = ? AND format = ?", evict)
+        return len(evict)
+
+    def stats(self):
+        """Returns hit/miss counts and hit rates for records and searches, plus the stored size."""
+        lookups = self.hits + self.misses
+        search_lookups = self.search_hits + self.search_misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "search_hits": self.search_hits,
+            "search_misses": self.search_misses,
+            "search_hit_rate": self.search_hits / search_lookups if search_lookups else 0.0,
+            "size_bytes": self.size_bytes(),
+        }
+
+    def close(self):
+        self._conn.close()
@@ -1,14 +1,60 @@
+import json
 import re
 import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from urllib.error import HTTPError
+from io import BytesIO
+from urllib.error import URLError
 
-import pandas as pd
 import streamlit as st
 from Bio import Entrez, Medline
 
+from aiweb_common.resource.MedlineRecordParser import (
+    MedlineColumnBuilder,
+    parse_medline_stream,
+)
+from aiweb_common.resource.PubMedXMLParser import (
+    iterparse_pubmed_articles,
+    parse_article_element,
+)
+from aiweb_common.resource.rate_limiting import RateLimiter, backoff_delay
+
 # TODO add configuration to LLM_utils that is specific to LLM_Interfaces, PubMed, etc.
 
+GIVE_UP_MESSAGE = (
+    "Giving up on PubMed. It was an issue on their end. You may want to try again later."
+)
+
+# Used to re-assemble cached articles when no efetch response has supplied a DOCTYPE yet
+DEFAULT_PUBMED_DOCTYPE = (
+    '<!DOCTYPE PubmedArticleSet PUBLIC "-//NLM//DTD PubMedArticle, 1st January 2025//EN" '
+    '"https://dtd.nlm.nih.gov/ncbi/pubmed/out/pubmed_250101.dtd">'
+)
+_DOCTYPE_PATTERN = re.compile(rb"<!DOCTYPE[^>]*>")
+_ARTICLE_PATTERN = re.compile(rb"<PubmedArticle>.*?</PubmedArticle>", re.DOTALL)
+# The first PMID of an article is its MedlineCitation PMID; later ones are references
+_PMID_PATTERN = re.compile(rb"<PMID[^>]*>\s*(\d+)\s*</PMID>")
+
+# E-utilities only page through the first 10,000 records of a PubMed search
+PUBMED_HISTORY_LIMIT = 10_000
+
+
+def _split_pubmed_articles(raw_xml):
+    """
+    Splits a raw efetch XML response into one `PubmedArticle` element per PMID, and returns them
+    together with the response's DOCTYPE declaration. The elements are slices of the original
+    bytes rather than re-serialized trees, so namespace prefixes such as MathML's `mml:` are kept
+    as `Entrez.read` expects them.
+    """
+    doctype = _DOCTYPE_PATTERN.search(raw_xml)
+    articles = {}
+    for match in _ARTICLE_PATTERN.finditer(raw_xml):
+        pmid = _PMID_PATTERN.search(match.group(0))
+        if pmid is not None:
+            articles[pmid.group(1).decode("utf-8")] = match.group(0).decode("utf-8")
+    return (doctype.group(0).decode("utf-8") if doctype else None), articles
+
 
 class PubMedInterface:
     def __init__(
@@ -18,86 +64,122 @@ class PubMedInterface:
         streamlit_context=False,
         max_retries=3,
         delay_seconds=5,
+        api_key=None,
+        efetch_batch_size=200,
+        max_workers=3,
+        cache=None,
     ):
+        """
+        Args:
+            email: The email address NCBI associates with our requests.
+            max_results: Maximum number of IDs returned by `search_pubmed_articles`.
+            streamlit_context: Whether to surface retry warnings in the Streamlit app.
+            max_retries: Number of retries after a failed request.
+            delay_seconds: Scale of the jittered exponential backoff between retries.
+            api_key: Optional NCBI API key; raises the request rate limit from 3 to 10 per second.
+            efetch_batch_size: Number of PMIDs requested per efetch call.
+            max_workers: Number of efetch batches requested concurrently.
+            cache: Optional `PubMedRecordCache`; cached PMIDs and searches skip NCBI entirely.
+        """
         self.email = email
         self.max_results = max_results
         self.streamlit_context = streamlit_context
         self.max_retries = max_retries
         self.delay_seconds = delay_seconds
+        self.efetch_batch_size = efetch_batch_size
+        self.max_workers = max_workers
+        self.cache = cache
         Entrez.email = email
+        if api_key is not None:
+            Entrez.api_key = api_key
+        # One limiter per key for the whole process, so concurrent instances share NCBI's budget
+        self.rate_limiter = RateLimiter.shared(f"ncbi:{api_key}", 10 if api_key else 3)
 
-    def _format_authors(self):
-        """
-        The function `format_authors` takes a list of strings representing authors and returns a
-        formatted string of their last names followed by initials, following APA rules.
-
-        Args:
-        author_list: A list of strings, where each string represents an author in the format "Last Name Initials".
+    def _warn(self, *messages, final=False):
+        for message in messages:
+            print(message)
+            if self.streamlit_context and final:
+                st.error(message)
+            elif self.streamlit_context:
+                st.warning(message)
 
-        Returns:
-        a formatted string of authors' names in the format "Last Name, Initials," following APA rules.
+    def _call_entrez(self, request, show_in_streamlit=True):
+        """
+        Runs `request` under the shared NCBI rate limiter, retrying network and HTTP errors with
+        jittered exponential backoff. Raises the last error once the retries are used up.
+        Streamlit warnings are skipped for calls made from worker threads.
         """
-        formatted_authors = []
-        num_authors = len(self._authors)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                return request()
+            except URLError as e:
+                error_message = (
+                    f"PubMed didn't respond (attempt {attempt + 1}/{self.max_retries + 1}): {e}"
+                )
+                if attempt == self.max_retries:
+                    print(error_message)
+                    raise
+                delay = backoff_delay(attempt, self.delay_seconds)
+                wait_message = f"Waiting {delay:.1f} seconds before trying PubMed again..."
+                if show_in_streamlit:
+                    self._warn(error_message, wait_message)
+                else:
+                    print(error_message)
+                    print(wait_message)
+                time.sleep(delay)
 
-        if num_authors <= 20:
-            # Normal case, just list all authors
-            for author in self._authors:
-                *last_name, initials = author.rsplit(" ", 1)
-                last_name = " ".join(last_name)
-                formatted_authors.append(f"{last_name}, {initials}.")
-            return ", ".join(formatted_authors)
-        else:
-            # APA rule for > 20 authors: first 19, ellipsis, last author
-            for author in self._authors[:19]:
-                *last_name, initials = author.rsplit(" ", 1)
-                last_name = " ".join(last_name)
-                formatted_authors.append(f"{last_name}, {initials}.")
+    def _fetch_in_batches(self, fetch_batch, pubmed_ids):
+        """
+        Splits `pubmed_ids` into batches of `efetch_batch_size` and runs `fetch_batch` on them
+        concurrently, `max_workers` at a time. Returns the per-batch results in input order.
+        """
+        batches = [
+            pubmed_ids[start : start + self.efetch_batch_size]
+            for start in range(0, len(pubmed_ids), self.efetch_batch_size)
+        ]
+        if len(batches) <= 1:
+            return [fetch_batch(batch) for batch in batches]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+            return list(executor.map(fetch_batch, batches))
 
-            last_author = self._authors[-1]
-            last_author_name, last_author_initials = last_author.rsplit(" ", 1)
+    def _fetch_medline_records(self, pubmed_ids):
+        # Records are parsed into columns as the response streams in; raw records are only
+        # kept when they need to go into the cache
+        def fetch():
+            handle = Entrez.efetch(
+                db="pubmed", id=",".join(pubmed_ids), rettype="medline", retmode="text"
+            )
+            raw_records = [] if self.cache is not None else None
+            try:
+                return parse_medline_stream(handle, raw_records), raw_records
+            finally:
+                handle.close()
 
-            formatted_authors.append("…")
-            formatted_authors.append(f"{last_author_name}, {last_author_initials}.")
+        return self._call_entrez(fetch, show_in_streamlit=False)
 
-            return ", ".join(formatted_authors)
+    def _read_xml_articles(self, pubmed_ids):
+        def fetch():
+            handle = Entrez.efetch(db="pubmed", id=",".join(pubmed_ids), retmode="xml")
+            try:
+                return Entrez.read(handle)["PubmedArticle"]
+            finally:
+                handle.close()
 
-    def _format_apa_citation(self):
-        """
-        The function `format_apa_citation` takes in an article and its ID and returns a formatted APA
-        citation string.
+        return self._call_entrez(fetch, show_in_streamlit=False)
 
-        Args:
-        article: The `article` parameter is a dictionary that contains information about a specific
-        article. It should have the following structure:
-        article_id: The article_id parameter is the unique identifier for the article. It is used to
-        include the PMID (PubMed ID) in the APA citation format.
+    def _fetch_xml_articles(self, pubmed_ids):
+        def fetch():
+            handle = Entrez.efetch(db="pubmed", id=",".join(pubmed_ids), retmode="xml")
+            try:
+                raw_xml = handle.read()
+            finally:
+                handle.close()
+            if isinstance(raw_xml, str):
+                raw_xml = raw_xml.encode("utf-8")
+            return _split_pubmed_articles(raw_xml)
 
-        Returns:
-        a formatted APA citation for an article, including the authors, publication year, title, journal,
-        volume, pages, and PMID (PubMed ID).
-        """
-        try:
-            authors = self._format_authors()
-        except KeyError:
-            authors = ""
-
-        return f"{authors} ({self._pub_month}). {self._title} {self._journal}, {self._volume}, {self._pages}. PMID: {self._pmid}"
-
-    def _extract_record_data(self, record):
-        # Extract the desired information
-        self._title = record.get("TI", "No title available")
-        self._keywords = record.get("OT", [])  # OT might not be present in all records
-        # try to use mesh headers if keywords not present
-        if not self._keywords:
-            self._keywords = record.get("MH", [])
-        self._abstract = record.get("AB", "No abstract available")
-        self._pmid = record.get("PMID", "No PMID available")
-        self._pub_month = record.get("DP", "No date available")
-        self._authors = record.get("AU", [])
-        self._journal = record.get("JT", "No jounral name available")
-        self._volume = record.get("VI", "No volume available")
-        self._pages = record.get("PG", "No pages available")
+        return self._call_entrez(fetch, show_in_streamlit=False)
 
     def search_pubmed_articles(self, query):
         """
@@ -117,138 +199,279 @@ class PubMedInterface:
         A list of PubMed article IDs that match the search criteria.
         """
 
-        for attempt in range(self.max_retries):
+        if self.cache is not None:
+            cached_ids = self.cache.get_search(query, self.max_results)
+            if cached_ids is not None:
+                return cached_ids
+
+        def search():
+            handle = Entrez.esearch(
+                db="pubmed", term=query, sort="relevance", retmax=self.max_results
+            )
             try:
-                handle = Entrez.esearch(
-                    db="pubmed", term=query, sort="relevance", retmax=self.max_results
-                )
-                record = Entrez.read(handle)
+                return Entrez.read(handle)["IdList"]
+            finally:
                 handle.close()
-                return record["IdList"]
-            except HTTPError as e:
-                error_message = (
-                    f"PubMed didn't respond (attempt {attempt + 1}/{self.max_retries}): {e}"
-                )
-                if attempt < self.max_retries:
-                    wait_message = (
-                        f"Waiting {self.delay_seconds} seconds before trying PubMed again..."
-                    )
-                    print(error_message)
-                    print(wait_message)
-                    if self.streamlit_context:
-                        st.warning(error_message)
-                        st.warning(wait_message)
-                    time.sleep(self.delay_seconds)
-                else:
-                    final_message = "Giving up on PubMed. It was an issue on their end. You may want to try again later."
-                    print(error_message)
-                    print(final_message)
-                    if self.streamlit_context:
-                        st.warning(error_message)
-                        st.warning(final_message)
-                    return []
 
-    def fetch_article_details(self, pubmed_ids):
+        try:
+            id_list = self._call_entrez(search)
+        except URLError:
+            self._warn(GIVE_UP_MESSAGE)
+            return []
+        if self.cache is not None:
+            self.cache.put_search(query, self.max_results, [str(pmid) for pmid in id_list])
+        return id_list
+
+    def count_pubmed_results(self, query):
+        """
+        The function `count_pubmed_results` returns how many PubMed articles match `query`, using a
+        count-only esearch (`retmax=0`) that transfers no IDs.
+
+        Args:
+          query: The search query string for PubMed.
+
+        Returns:
+          The number of matching articles. Raises `URLError` if PubMed could not be reached.
+        """
+
+        def count():
+            handle = Entrez.esearch(db="pubmed", term=query, retmax=0)
+            try:
+                return int(Entrez.read(handle)["Count"])
+            finally:
+                handle.close()
+
+        return self._call_entrez(count, show_in_streamlit=False)
+
+    def fetch_article_details(self, pubmed_ids, as_arrow=False):
         """
-        The function fetches article details from PubMed using the provided PubMed IDs.
+        The function fetches article details from PubMed using the provided PubMed IDs. The IDs are
+        requested in batches of `efetch_batch_size`, several batches at a time under the shared NCBI
+        rate limit.
 
         Args:
         pubmed_ids: A list of strings where each string represents the PubMed ID (PMID)
                     of the article you want to fetch details for.
-        max_retries: The maximum number of retry attempts if an HTTP error occurs. Default is 3.
-        delay_seconds: The number of seconds to wait between retry attempts. Default is 5.
-        streamlit_context: A boolean flag indicating whether the code is running within a Streamlit app. Default is False.
+        as_arrow: Return a `pyarrow.Table` instead of a DataFrame.
 
         Returns:
-        A list of dictionaries, where each dictionary contains the details of an article with the given PubMed ID.
+        A DataFrame (or Arrow table) with one row per article, in the order of `pubmed_ids`, or None
+        if PubMed could not be reached.
         """
         pubmed_ids = [str(id) for id in pubmed_ids]
-        ids_string = ",".join(pubmed_ids)
+        builder = MedlineColumnBuilder()
+        if self.cache is not None:
+            for payload in self.cache.get_records(pubmed_ids, "medline").values():
+                builder.append(Medline.Record(json.loads(payload)))
+        cached_ids = set(builder.columns["pmid"])
+        missing_ids = [pmid for pmid in dict.fromkeys(pubmed_ids) if pmid not in cached_ids]
 
-        for attempt in range(self.max_retries + 1):
-            try:
-                handle = Entrez.efetch(
-                    db="pubmed", id=ids_string, rettype="medline", retmode="text"
-                )
-                records = Medline.parse(handle)
-                records = list(records)
-                parsed_data = []
-                for record in records:
-                    self._extract_record_data(record)
-                    citation = self._format_apa_citation()
-                    parsed_data.append(
-                        {
-                            "date_published": self._pub_month,
-                            "title": self._title,
-                            "keywords": self._keywords,
-                            "abstract": self._abstract,
-                            "pmid": self._pmid,
-                            "authors": self._authors,
-                            "journal": self._journal,
-                            "citation": citation,
-                        }
-                    )
-
-                parsed_df = pd.DataFrame(parsed_data)
-                return parsed_df
-            except HTTPError as e:
-                error_message = (
-                    f"PubMed didn't respond (attempt {attempt + 1}/{self.max_retries}): {e}"
+        try:
+            batches = self._fetch_in_batches(self._fetch_medline_records, missing_ids)
+        except URLError:
+            self._warn(GIVE_UP_MESSAGE)
+            return None
+
+        for batch_builder, raw_records in batches:
+            builder.extend(batch_builder)
+            if raw_records:
+                self.cache.put_records(
+                    {record.get("PMID"): json.dumps(record) for record in raw_records}, "medline"
                 )
-                if attempt < self.max_retries:
-                    wait_message = (
-                        f"Waiting {self.delay_seconds} seconds before trying PubMed again..."
-                    )
-                    print(error_message)
-                    print(wait_message)
-                else:
-                    final_message = "Giving up on PubMed. It was an issue on their end. You may want to try again later."
-                    print(error_message)
-                    print(final_message)
-                    return None
+        if as_arrow:
+            return builder.to_arrow(order=pubmed_ids)
+        return builder.to_dataframe(order=pubmed_ids)
+
+    def search_pubmed_history(self, query):
+        """
+        The function `search_pubmed_history` runs an esearch that leaves its result set on the
+        Entrez history server instead of returning the IDs.
+
+        Args:
+          query: The search query string for PubMed.
+
+        Returns:
+          A tuple (count, webenv, query_key); `webenv` and `query_key` identify the result set
+        for subsequent efetch calls.
+        """
+
+        def search():
+            handle = Entrez.esearch(
+                db="pubmed", term=query, sort="relevance", retmax=0, usehistory="y"
+            )
+            try:
+                return Entrez.read(handle)
+            finally:
+                handle.close()
+
+        record = self._call_entrez(search)
+        return int(record["Count"]), record["WebEnv"], record["QueryKey"]
+
+    def _fetch_history_page(self, webenv, query_key, retstart, retmax):
+        def fetch():
+            handle = Entrez.efetch(
+                db="pubmed",
+                webenv=webenv,
+                query_key=query_key,
+                retstart=retstart,
+                retmax=retmax,
+                rettype="medline",
+                retmode="text",
+            )
+            try:
+                return parse_medline_stream(handle)
+            finally:
+                handle.close()
+
+        return self._call_entrez(fetch, show_in_streamlit=False)
+
+    def iter_article_details(self, query, batch_size=500, max_records=None):
+        """
+        The function `iter_article_details` streams the articles matching `query` page by page
+        using the Entrez history server (`usehistory=y` with WebEnv/query_key), so callers can
+        process thousands of records without holding the full ID list or response in memory.
+        The next page is requested while the caller processes the current one.
+
+        Args:
+          query: The search query string for PubMed.
+          batch_size: Number of records per efetch page.
+          max_records: Optional cap on the number of records. PubMed itself only serves the
+        first 10,000 records of a search through E-utilities.
+
+        Returns:
+          A generator of DataFrames, one per page, with the same columns as
+        `fetch_article_details`. Like the other methods, it warns instead of raising when PubMed
+        cannot be reached, and stops early.
+        """
+        try:
+            count, webenv, query_key = self.search_pubmed_history(query)
+        except URLError:
+            self._warn(GIVE_UP_MESSAGE, final=True)
+            return
+        total = min(count, PUBMED_HISTORY_LIMIT)
+        if max_records is not None:
+            total = min(total, max_records)
+        page_starts = range(0, total, batch_size)
+        if not page_starts:
+            return
+
+        def fetch_page(retstart):
+            retmax = min(batch_size, total - retstart)
+            return self._fetch_history_page(webenv, query_key, retstart, retmax)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_page = executor.submit(fetch_page, page_starts[0])
+            for following_start in list(page_starts[1:]) + [None]:
+                try:
+                    page = next_page.result()
+                except URLError:
+                    self._warn(GIVE_UP_MESSAGE, final=True)
+                    return
+                if following_start is not None:
+                    next_page = executor.submit(fetch_page, following_start)
+                yield page.to_dataframe()
 
     def fetch_article_details_xml(self, pubmed_ids):
         """
-        The function fetches article details from PubMed using the provided PubMed IDs.
+        The function fetches article details from PubMed using the provided PubMed IDs, batched and
+        rate limited like `fetch_article_details`.
 
         Args:
         pubmed_ids: A list of strings where each string represents the PubMed ID (PMID)
                     of the article you want to fetch details for.
-        max_retries: The maximum number of retry attempts if an HTTP error occurs. Default is 3.
-        delay_seconds: The number of seconds to wait between retry attempts. Default is 5.
-        streamlit_context: A boolean flag indicating whether the code is running within a Streamlit app. Default is False.
 
         Returns:
-        A list of dictionaries, where each dictionary contains the details of an article with the given PubMed ID.
+        A list of parsed PubmedArticle records in the order of `pubmed_ids`. The whole response is
+        held in memory; use `iter_article_details_xml` for large batches.
         """
-        ids_string = ",".join(pubmed_ids)
+        pubmed_ids = [str(id) for id in pubmed_ids]
+        if self.cache is None:
+            # Without a cache each response is read directly, as it was before batching
+            try:
+                article_batches = self._fetch_in_batches(
+                    self._read_xml_articles, list(dict.fromkeys(pubmed_ids))
+                )
+            except URLError:
+                self._warn(GIVE_UP_MESSAGE, final=True)
+                return []
+            articles = {
+                str(article["MedlineCitation"]["PMID"]): article
+                for batch in article_batches
+                for article in batch
+            }
+            return [articles[pmid] for pmid in dict.fromkeys(pubmed_ids) if pmid in articles]
 
-        for attempt in range(self.max_retries + 1):
+        article_xml = self.cache.get_records(pubmed_ids, "xml")
+        doctype = self.cache.get_meta("xml_doctype")
+        missing_ids = [pmid for pmid in dict.fromkeys(pubmed_ids) if pmid not in article_xml]
+
+        try:
+            article_batches = self._fetch_in_batches(self._fetch_xml_articles, missing_ids)
+        except URLError:
+            self._warn(GIVE_UP_MESSAGE, final=True)
+            return []
+
+        fetched = {}
+        for batch_doctype, articles in article_batches:
+            doctype = batch_doctype or doctype
+            fetched.update(articles)
+        if fetched:
+            self.cache.put_records(fetched, "xml")
+            if doctype is not None:
+                self.cache.set_meta("xml_doctype", doctype)
+        article_xml.update(fetched)
+
+        ordered_xml = [
+            article_xml[pmid] for pmid in dict.fromkeys(pubmed_ids) if pmid in article_xml
+        ]
+        if not ordered_xml:
+            return []
+        # Re-assemble a single document so Entrez.read validates it against the PubMed DTD
+        document = (
+            f'<?xml version="1.0" ?>\n{doctype or DEFAULT_PUBMED_DOCTYPE}\n'
+            f"<PubmedArticleSet>{''.join(ordered_xml)}</PubmedArticleSet>"
+        )
+        return Entrez.read(BytesIO(document.encode("utf-8")))["PubmedArticle"]
+
+    def iter_article_details_xml(self, pubmed_ids):
+        """
+        The function `iter_article_details_xml` streams article details from PubMed's XML format
+        one article at a time. Each efetch response is parsed incrementally while it downloads and
+        every article element is released once its fields are extracted, so memory no longer grows
+        with the batch size as it does with `Entrez.read`.
+
+        Args:
+          pubmed_ids: A list of PubMed IDs (PMIDs) to fetch.
+
+        Returns:
+          A generator of dicts with the PMID, title, abstract, journal, publication date, authors,
+        keywords and MeSH headings of each article (see `PubMedXMLParser.parse_article_element`).
+        Cached articles come first, then the rest in the order PubMed returns them. Stops early
+        if PubMed cannot be reached.
+        """
+        pubmed_ids = list(dict.fromkeys(str(id) for id in pubmed_ids))
+        missing_ids = pubmed_ids
+        if self.cache is not None:
+            cached = self.cache.get_records(pubmed_ids, "xml")
+            for pmid in pubmed_ids:
+                if pmid in cached:
+                    yield parse_article_element(ET.fromstring(cached[pmid]))
+            missing_ids = [pmid for pmid in pubmed_ids if pmid not in cached]
+
+        for start in range(0, len(missing_ids), self.efetch_batch_size):
+            batch = missing_ids[start : start + self.efetch_batch_size]
+            # Only opening the request is retried; the response is consumed as it is parsed
             try:
-                handle = Entrez.efetch(db="pubmed", id=ids_string, retmode="xml")
-                articles = Entrez.read(handle)["PubmedArticle"]
-                handle.close()
-                return articles
-            except HTTPError as e:
-                error_message = (
-                    f"PubMed didn't respond (attempt {attempt + 1}/{self.max_retries}): {e}"
+                handle = self._call_entrez(
+                    lambda: Entrez.efetch(db="pubmed", id=",".join(batch), retmode="xml")
                 )
-                if attempt < self.max_retries:
-                    wait_message = (
-                        f"Waiting {self.delay_seconds} seconds before trying PubMed again..."
-                    )
-                    print(error_message)
-                    print(wait_message)
-                    if self.streamlit_context:
-                        # TODO Ask about these imports...
-                        st.warning(error_message)
-                        st.warning(wait_message)
-                    time.sleep(self.delay_seconds)
-                else:
-                    final_message = "Giving up on PubMed. It was an issue on their end. You may want to try again later."
-                    print(error_message)
-                    print(final_message)
-                    if self.streamlit_context:
-                        st.warning(error_message)
-                        st.error(final_message)
-                    return []
+            except URLError:
+                self._warn(GIVE_UP_MESSAGE, final=True)
+                return
+            raw_articles = {} if self.cache is not None else None
+            try:
+                yield from iterparse_pubmed_articles(handle, raw_articles)
+            finally:
+                handle.close()
+            if raw_articles:
+                self.cache.put_records(raw_articles, "xml")
@@ -1,8 +1,22 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+
 from aiweb_common.generate.SingleResponse import SingleResponseHandler
 from aiweb_common.resource import default_resource_config
 from aiweb_common.WorkflowHandler import WorkflowHandler
 
 
+def _pick_best_candidate(candidates, min_results):
+    # Prefer the most specific query that still returns min_results; otherwise the broadest one
+    counted = [candidate for candidate in candidates if candidate[1] is not None]
+    if not counted:
+        return candidates[0][0], None
+    enough = [candidate for candidate in counted if candidate[1] >= min_results]
+    if enough:
+        return min(enough, key=lambda candidate: candidate[1])
+    return max(counted, key=lambda candidate: candidate[1])
+
+
 class PubMedQueryGenerator(WorkflowHandler):
     def __init__(
         self,
@@ -34,6 +48,9 @@ class PubMedQueryGenerator(WorkflowHandler):
         if loop_n > 0:
             prompt = prompt + default_resource_config.PUBMED_FEW_RESULTS_PROMPT + last_query
 
+        return self._generate_from_prompt(prompt)
+
+    def _generate_from_prompt(self, prompt):
         assembled_prompt = self.single_response.single_response_service.preparer.assemble_prompt(
             system_prompt=default_resource_config.PUBMED_SYSTEM_PROMPT,
             user_prompt=prompt,
@@ -43,3 +60,41 @@ class PubMedQueryGenerator(WorkflowHandler):
         self._update_total_cost(response_meta)
 
         return response.content
+
+    def generate_best_search_string(
+        self, pubmed_interface, min_results=None, candidate_prompts=None
+    ):
+        """
+        The function `generate_best_search_string` replaces the sequential retry loop around
+        `generate_search_string` with a single parallel round: several candidate search strings are
+        generated concurrently, each is checked with a count-only PubMed search as soon as it is
+        ready, and the best one is returned.
+
+        Args:
+          pubmed_interface: The `PubMedInterface` used to count the results of each candidate.
+          min_results: Number of results a candidate should reach; defaults to the interface's
+        `max_results`.
+          candidate_prompts: Suffixes appended to the query prompt, one per candidate. Defaults to
+        `default_resource_config.PUBMED_CANDIDATE_PROMPTS`.
+
+        Returns:
+          A tuple (query, count). The query is the most specific candidate with at least
+        `min_results` results, or the candidate with the most results if none reach it. The count is
+        None if PubMed could not be reached for any candidate.
+        """
+        if min_results is None:
+            min_results = pubmed_interface.max_results
+        if candidate_prompts is None:
+            candidate_prompts = default_resource_config.PUBMED_CANDIDATE_PROMPTS
+        prompt = default_resource_config.PUBMED_QUERY_PROMPT.format(self.input_research_q)
+
+        def generate_and_count(candidate_prompt):
+            query = self._generate_from_prompt(prompt + candidate_prompt).strip()
+            try:
+                return query, pubmed_interface.count_pubmed_results(query)
+            except URLError:
+                return query, None
+
+        with ThreadPoolExecutor(max_workers=len(candidate_prompts)) as executor:
+            candidates = list(executor.map(generate_and_count, candidate_prompts))
+        return _pick_best_candidate(candidates, min_results)
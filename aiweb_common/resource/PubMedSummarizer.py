@@ -0,0 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+import tiktoken
+
+from aiweb_common.generate.SingleResponse import SingleResponseHandler
+from aiweb_common.resource import default_resource_config
+from aiweb_common.WorkflowHandler import WorkflowHandler
+
+
+def _format_article(article):
+    return (
+        f"PMID: {article.get('pmid', '')}\n"
+        f"Title: {article.get('title', '')}\n"
+        f"Abstract: {article.get('abstract', '')}"
+    )
+
+
+class PubMedSummarizer(WorkflowHandler):
+    """
+    The `PubMedSummarizer` class summarizes many PubMed abstracts with a map-reduce pass instead of
+    a single oversized prompt. Abstracts are packed into groups that fit `group_tokens`, the groups
+    are summarized concurrently (map), and the summaries are packed and summarized again until a
+    single summary is left (reduce). The cost of every call is added to `total_cost`.
+    """
+
+    def __init__(
+        self,
+        LLM_INTERFACE,
+        input_research_q,
+        group_tokens=6000,
+        max_workers=4,
+        encoding_name="cl100k_base",
+    ):
+        """
+        Args:
+            LLM_INTERFACE: The LangChain chat model used for every summary.
+            input_research_q: The research question the summaries should focus on.
+            group_tokens: Token budget of the documents packed into one prompt.
+            max_workers: Number of summaries requested concurrently.
+            encoding_name: The tiktoken encoding used to count tokens.
+        """
+        super().__init__()
+        self.input_research_q = input_research_q
+        self.group_tokens = group_tokens
+        self.max_workers = max_workers
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.single_response = SingleResponseHandler(LLM_INTERFACE)
+
+    def _pack(self, texts, min_group_size=1):
+        # min_group_size=2 guarantees every reduce level shrinks, even when summaries are long
+        groups = []
+        group = []
+        group_tokens = 0
+        for text in texts:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) > self.group_tokens:
+                text = self.encoding.decode(tokens[: self.group_tokens])
+                tokens = tokens[: self.group_tokens]
+            if group and len(group) >= min_group_size:
+                if group_tokens + len(tokens) > self.group_tokens:
+                    groups.append(group)
+                    group = []
+                    group_tokens = 0
+            group.append(text)
+            group_tokens += len(tokens)
+        if group:
+            groups.append(group)
+        return groups
+
+    def _summarize(self, user_prompt, texts):
+        assembled_prompt = self.single_response.single_response_service.preparer.assemble_prompt(
+            system_prompt=default_resource_config.PUBMED_SUMMARY_SYSTEM_PROMPT,
+            user_prompt=user_prompt,
+            research_question=self.input_research_q,
+            documents="\n\n".join(texts),
+        )
+        response, response_meta = self.single_response.generate_response(assembled_prompt)
+        self._update_total_cost(response_meta)
+        return response.content
+
+    def iter_summaries(self, articles):
+        """
+        The function `iter_summaries` runs the map-reduce summary and yields every summary as soon
+        as it is ready, so apps can show partial results while the rest are still being generated.
+
+        Args:
+          articles: A DataFrame from `PubMedInterface.fetch_article_details`, or an iterable of
+        dicts with "pmid", "title" and "abstract" keys (e.g. from `iter_article_details_xml`).
+
+        Returns:
+          A generator of dicts with the keys "level" (0 for the map step, then 1, 2, ... for each
+        reduce level), "group", "summary" and "final", which is True only for the last summary.
+        """
+        if isinstance(articles, pd.DataFrame):
+            articles = articles.to_dict("records")
+        texts = [_format_article(article) for article in articles]
+        if not texts:
+            return
+
+        level = 0
+        user_prompt = default_resource_config.PUBMED_SUMMARY_MAP_PROMPT
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                groups = self._pack(texts, min_group_size=1 if level == 0 else 2)
+                futures = {
+                    executor.submit(self._summarize, user_prompt, group): index
+                    for index, group in enumerate(groups)
+                }
+                summaries = [None] * len(groups)
+                for future in as_completed(futures):
+                    index = futures[future]
+                    summaries[index] = future.result()
+                    yield {
+                        "level": level,
+                        "group": index,
+                        "summary": summaries[index],
+                        "final": len(groups) == 1,
+                    }
+                if len(groups) == 1:
+                    return
+                texts = summaries
+                level += 1
+                user_prompt = default_resource_config.PUBMED_SUMMARY_REDUCE_PROMPT
+
+    def process(self, articles):
+        """
+        Returns the final summary of `articles` (see `iter_summaries`), or an empty string if
+        there are no articles.
+        """
+        summary = ""
+        for partial in self.iter_summaries(articles):
+            if partial["final"]:
+                summary = partial["summary"]
+        return summary
@@ -0,0 +1,117 @@
+import threading
+
+import numpy as np
+import pandas as pd
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+from aiweb_common.generate.AugmentedServicer import RAGServicer
+from aiweb_common.generate.MetadataFilterIndex import MetadataFilterIndex
+from aiweb_common.generate.VectorIndexFactory import create_index
+
+# Article fields kept as document metadata; list-valued fields such as authors are left out
+METADATA_FIELDS = ("pmid", "title", "journal", "date_published", "citation")
+
+
+def _article_document(article):
+    return Document(
+        page_content=f"{article.get('title', '')}\n\n{article.get('abstract', '')}",
+        metadata={field: article[field] for field in METADATA_FIELDS if field in article},
+    )
+
+
+class PubMedVectorIndex:
+    """
+    The `PubMedVectorIndex` class builds in-memory FAISS vectorstores straight from PubMed results
+    (e.g. the DataFrame returned by `PubMedInterface.fetch_article_details`), without writing a CSV
+    and running `VectorStoreBuilder`. Embeddings are cached by PMID for the lifetime of the
+    instance, so articles returned by several searches are only embedded once.
+
+    Use `build` for a LangChain `FAISS` object, or `servicer` to query the articles through
+    `RAGServicer`.
+    """
+
+    def __init__(self, embedding_interface, filter_fields=("journal",)):
+        """
+        Args:
+            embedding_interface: The LangChain embedding interface used to embed the articles and
+                the queries.
+            filter_fields: Article fields indexed for filtered retrieval in `RAGServicer`.
+        """
+        self.embedding_interface = embedding_interface
+        self.filter_fields = filter_fields
+        self.hits = 0
+        self.misses = 0
+        self._embeddings = {}
+        self._lock = threading.Lock()
+
+    def _embed(self, documents):
+        pmids = [document.metadata["pmid"] for document in documents]
+        with self._lock:
+            missing = {
+                pmid: document
+                for pmid, document in zip(pmids, documents)
+                if pmid not in self._embeddings
+            }
+            self.hits += len(pmids) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            vectors = self.embedding_interface.embed_documents(
+                [document.page_content for document in missing.values()]
+            )
+            with self._lock:
+                for pmid, vector in zip(missing, vectors):
+                    self._embeddings[pmid] = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            return np.vstack([self._embeddings[pmid] for pmid in pmids])
+
+    def build(self, articles):
+        """
+        The function `build` embeds the articles (reusing cached embeddings) and indexes them.
+
+        Args:
+          articles: A DataFrame from `PubMedInterface.fetch_article_details`, or an iterable of
+        dicts with at least "pmid", "title" and "abstract" keys.
+
+        Returns:
+          A tuple (vectordb, filter_index) of an in-memory LangChain `FAISS` vectorstore with one
+        document per PMID and the `MetadataFilterIndex` of its `filter_fields`.
+        """
+        if isinstance(articles, pd.DataFrame):
+            articles = articles.to_dict("records")
+        documents = {}
+        for article in articles:
+            document = _article_document({**article, "pmid": str(article["pmid"])})
+            documents.setdefault(document.metadata["pmid"], document)
+        if not documents:
+            raise ValueError("No articles found to add to the vectorstore.")
+        documents = list(documents.values())
+
+        vectors = self._embed(documents)
+        index = create_index("flat", vectors)
+        index.add(vectors)
+        filter_index = MetadataFilterIndex(self.filter_fields)
+        for position, document in enumerate(documents):
+            filter_index.add(position, document.metadata)
+        vectordb = FAISS(
+            embedding_function=self.embedding_interface,
+            index=index,
+            docstore=InMemoryDocstore(
+                {document.metadata["pmid"]: document for document in documents}
+            ),
+            index_to_docstore_id={
+                position: document.metadata["pmid"] for position, document in enumerate(documents)
+            },
+        )
+        return vectordb, filter_index
+
+    def servicer(self, language_model_interface, articles):
+        """Returns a `RAGServicer` over an in-memory vectorstore of `articles` (see `build`)."""
+        vectordb, filter_index = self.build(articles)
+        return RAGServicer(
+            language_model_interface,
+            self.embedding_interface,
+            vectordb,
+            filter_index=filter_index,
+        )
@@ -0,0 +1,124 @@
+import xml.etree.ElementTree as ET
+
+# Namespaces used inside PubMed records. Registering them makes ET.tostring keep their usual
+# prefixes, which Entrez.read requires, instead of renaming them to ns0, ns1, ...
+PUBMED_NAMESPACES = {
+    "mml": "http://www.w3.org/1998/Math/MathML",
+    "xlink": "http://www.w3.org/1999/xlink",
+    "ali": "http://www.niso.org/schemas/ali/1.0/",
+}
+for _prefix, _uri in PUBMED_NAMESPACES.items():
+    ET.register_namespace(_prefix, _uri)
+
+
+def _text(element):
+    # itertext keeps the text of inline markup such as <i> or <sup> in titles and abstracts
+    return "".join(element.itertext()).strip() if element is not None else ""
+
+
+def _abstract(article):
+    sections = []
+    for section in article.iterfind("Abstract/AbstractText"):
+        label = section.get("Label")
+        text = _text(section)
+        sections.append(f"{label}: {text}" if label else text)
+    return " ".join(sections)
+
+
+def _publication_date(article):
+    pub_date = article.find("Journal/JournalIssue/PubDate")
+    if pub_date is None:
+        return ""
+    medline_date = pub_date.findtext("MedlineDate")
+    if medline_date:
+        return medline_date
+    return " ".join(
+        part for part in (pub_date.findtext(tag) for tag in ("Year", "Month", "Day")) if part
+    )
+
+
+def _authors(article):
+    authors = []
+    for author in article.iterfind("AuthorList/Author"):
+        collective_name = author.findtext("CollectiveName")
+        if collective_name:
+            authors.append(collective_name)
+            continue
+        name = " ".join(
+            part for part in (author.findtext("LastName"), author.findtext("Initials")) if part
+        )
+        if name:
+            authors.append(name)
+    return authors
+
+
+def _mesh_headings(citation):
+    headings = []
+    for heading in citation.iterfind("MeshHeadingList/MeshHeading"):
+        descriptor = heading.find("DescriptorName")
+        if descriptor is None:
+            continue
+        headings.append(
+            {
+                "descriptor": _text(descriptor),
+                "ui": descriptor.get("UI"),
+                "major_topic": descriptor.get("MajorTopicYN") == "Y",
+                "qualifiers": [_text(qualifier) for qualifier in heading.iterfind("QualifierName")],
+            }
+        )
+    return headings
+
+
+def parse_article_element(element):
+    """
+    The function `parse_article_element` extracts the fields we use from a `PubmedArticle`
+    element.
+
+    Args:
+      element: An `xml.etree.ElementTree.Element` for one `PubmedArticle`.
+
+    Returns:
+      A dict with the PMID, title, abstract, journal, publication date, authors, keywords and
+    MeSH headings (descriptor, UI, major-topic flag and qualifiers) of the article.
+    """
+    citation = element.find("MedlineCitation")
+    article = citation.find("Article")
+    return {
+        "pmid": citation.findtext("PMID", ""),
+        "title": _text(article.find("ArticleTitle")),
+        "abstract": _abstract(article),
+        "journal": article.findtext("Journal/Title", ""),
+        "date_published": _publication_date(article),
+        "authors": _authors(article),
+        "keywords": [_text(keyword) for keyword in citation.iterfind("KeywordList/Keyword")],
+        "mesh_headings": _mesh_headings(citation),
+    }
+
+
+def iterparse_pubmed_articles(handle, raw_articles=None):
+    """
+    The function `iterparse_pubmed_articles` incrementally parses a PubMed efetch XML response,
+    yielding one parsed article at a time instead of building the whole PubmedArticleSet tree.
+    Each article element is discarded once it has been parsed, so memory stays bounded by a
+    single article.
+
+    Args:
+      handle: A binary handle such as the one returned by `Entrez.efetch(retmode="xml")`.
+      raw_articles: Optional dict that receives each article's serialized XML keyed by PMID
+    (e.g. for caching).
+
+    Returns:
+      A generator of dicts as returned by `parse_article_element`.
+    """
+    root = None
+    for event, element in ET.iterparse(handle, events=("start", "end")):
+        if root is None and event == "start":
+            root = element
+        if event != "end" or element.tag != "PubmedArticle":
+            continue
+        parsed = parse_article_element(element)
+        if raw_articles is not None:
+            raw_articles[parsed["pmid"]] = ET.tostring(element, encoding="unicode")
+        # Drop the finished article (and anything before it) from the partially built tree
+        root.clear()
+        yield parsed
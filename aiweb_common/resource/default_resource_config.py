@@ -3,11 +3,27 @@ PUBMED_QUERY_PROMPT = "Given the following research question, suggest a PubMed s
 
 PUBMED_FEW_RESULTS_PROMPT = "\n\n The following query returned no or few results. Please suggest a simpler one (i.e., with fewer query elements).\n\n"
 
+# Appended to PUBMED_QUERY_PROMPT to vary the candidates generated in parallel. The last one asks
+# up front for the simpler query PUBMED_FEW_RESULTS_PROMPT asks for after a failed search.
+PUBMED_CANDIDATE_PROMPTS = [
+    "",
+    "\n\n Use MeSH terms where they apply.",
+    "\n\n Keep the query simple, with at most three query elements.",
+]
+
 PUBMED_SYSTEM_PROMPT = "You are an expert at conducting medical literature searches. You help beginning researchers with literature search and review."
 
+# Map-reduce summaries of PubMed abstracts; {research_question} and {documents} are filled in
+PUBMED_SUMMARY_SYSTEM_PROMPT = "You are an expert at reviewing medical literature. You write concise, accurate summaries that cite the PMIDs they draw on."
+
+PUBMED_SUMMARY_MAP_PROMPT = "Summarize the findings of the following PubMed articles that are relevant to this research question: {research_question}\n\nCite each finding with its PMID.\n\n{documents}"
+
+PUBMED_SUMMARY_REDUCE_PROMPT = "Combine the following summaries of PubMed articles into a single summary of the literature on this research question: {research_question}\n\nKeep the PMID citations.\n\n{documents}"
+
 
 # NIH RePORTER Configurables
 NIH_INCLUDE_FIELDS = [
+    "ApplId",
     "ContactPiName",
     "Organization",
     "ProjectTitle",
@@ -23,3 +39,71 @@ NIH_DEPARTMENTS = [
     "Physiology",
     "Surgery",
 ]
+
+# Used, after fiscal years, to split searches that exceed RePORTER's 15,000-record paging cap.
+# Agencies are the administering ICs/agencies; splits that do not cover a search are reported.
+NIH_PARTITION_AGENCIES = [
+    "NCI",
+    "NEI",
+    "NHLBI",
+    "NHGRI",
+    "NIA",
+    "NIAAA",
+    "NIAID",
+    "NIAMS",
+    "NIBIB",
+    "NICHD",
+    "NIDA",
+    "NIDCD",
+    "NIDCR",
+    "NIDDK",
+    "NIEHS",
+    "NIGMS",
+    "NIMH",
+    "NIMHD",
+    "NINDS",
+    "NINR",
+    "NLM",
+    "NCCIH",
+    "NCATS",
+    "FIC",
+    "OD",
+    "AHRQ",
+    "CDC",
+    "FDA",
+    "VA",
+]
+
+NIH_PARTITION_ACTIVITY_CODES = [
+    "R01",
+    "R03",
+    "R21",
+    "R33",
+    "R34",
+    "R35",
+    "R37",
+    "R56",
+    "R61",
+    "R43",
+    "R44",
+    "R41",
+    "R42",
+    "U01",
+    "U24",
+    "U54",
+    "UG3",
+    "UH3",
+    "UM1",
+    "P01",
+    "P30",
+    "P50",
+    "K01",
+    "K08",
+    "K23",
+    "K99",
+    "R00",
+    "T32",
+    "F30",
+    "F31",
+    "F32",
+]
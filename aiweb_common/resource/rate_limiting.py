@@ -0,0 +1,58 @@
+import random
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    The `RateLimiter` class spaces calls so that at most `rate_per_second` of them start per second,
+    across all threads sharing the limiter. Use `RateLimiter.shared` to get one limiter per API key
+    for the whole process, as required by NCBI and NIH RePORTER usage policies.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, key, rate_per_second):
+        """
+        Returns the process-wide limiter registered under `key`, creating it on first use. When
+        callers ask for different rates under the same key, the limiter keeps the stricter one.
+        """
+        with cls._shared_lock:
+            if key not in cls._shared:
+                cls._shared[key] = cls(rate_per_second)
+            limiter = cls._shared[key]
+        with limiter._lock:
+            limiter.interval = max(limiter.interval, 1.0 / rate_per_second)
+        return limiter
+
+    def acquire(self):
+        """Blocks until the caller may make its request."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def backoff_delay(attempt, base_seconds, max_seconds=60):
+    """
+    The function `backoff_delay` computes a "full jitter" exponential backoff delay, which spreads
+    out retries from concurrent workers instead of having them retry in lockstep.
+
+    Args:
+      attempt: The zero-based number of the attempt that just failed.
+      base_seconds: The delay scale of the first retry.
+      max_seconds: Upper bound of the delay.
+
+    Returns:
+      A random delay in seconds between 0 and min(max_seconds, base_seconds * 2**attempt).
+    """
+    return random.uniform(0, min(max_seconds, base_seconds * 2**attempt))
@@ -0,0 +1,64 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiweb_common.generate.CoalescingEmbeddings import CoalescingEmbeddings
+
+CALL_SECONDS = 0.1
+QUERIES = 16
+
+
+class SlowEmbeddings:
+    """Fake embedding interface where every request takes `CALL_SECONDS`."""
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _request(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(CALL_SECONDS)
+
+    def embed_documents(self, texts):
+        self._request()
+        return [[float(len(text)), 0.0] for text in texts]
+
+    def embed_query(self, text):
+        self._request()
+        return [float(len(text)), 1.0]
+
+
+class OpenAILikeEmbeddings(SlowEmbeddings):
+    pass
+
+
+OpenAILikeEmbeddings.__module__ = "langchain_openai.embeddings.base"
+
+
+def _concurrent_queries(embeddings):
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=QUERIES) as executor:
+        vectors = list(executor.map(embeddings.embed_query, [f"q{i}" for i in range(QUERIES)]))
+    return vectors, time.monotonic() - started
+
+
+def test_queries_are_batched_for_openai_interfaces():
+    interface = OpenAILikeEmbeddings()
+    embeddings = CoalescingEmbeddings(interface, max_wait_ms=20)
+    vectors, elapsed = _concurrent_queries(embeddings)
+    embeddings.close()
+    assert vectors == [[float(len(f"q{i}")), 0.0] for i in range(QUERIES)]
+    assert interface.calls == 1
+    assert elapsed < 4 * CALL_SECONDS
+
+
+def test_queries_run_concurrently_through_embed_query():
+    interface = SlowEmbeddings()
+    embeddings = CoalescingEmbeddings(interface, max_wait_ms=20)
+    vectors, elapsed = _concurrent_queries(embeddings)
+    embeddings.close()
+    assert vectors == [[float(len(f"q{i}")), 1.0] for i in range(QUERIES)]
+    assert interface.calls <= QUERIES
+    # Sequential embed_query calls would take QUERIES * CALL_SECONDS
+    assert elapsed < 4 * CALL_SECONDS
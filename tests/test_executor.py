@@ -0,0 +1,22 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from aiweb_common.fastapi.executor import TieredExecutor
+
+
+def test_timed_out_task_is_counted_once():
+    executor = TieredExecutor(thread_workers=1)
+
+    async def call():
+        with pytest.raises(HTTPException) as raised:
+            await executor.run(time.sleep, 0.2, timeout=0.05, name="sleep")
+        assert raised.value.status_code == 504
+
+    asyncio.run(call())
+    executor.shutdown(wait=True)
+    stats = executor.metrics.snapshot()["sleep"]
+    assert stats["timed_out"] == 1
+    assert stats["completed"] == 0
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from aiweb_common.generate.AugmentedServicer import RAGServicer
+from aiweb_common.generate.MetadataFilterIndex import MetadataFilterIndex
+from aiweb_common.generate.VectorIndexFactory import create_index, filtered_search
+
+DIMENSION = 32
+N_VECTORS = 3000
+# One source PDF contributes 3 of the 3000 chunks
+SOURCE_ROWS = [10, 1500, 2990]
+
+
+def _corpus():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(30, DIMENSION)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=N_VECTORS)]
+    return vectors + rng.normal(scale=0.1, size=vectors.shape).astype(np.float32)
+
+
+class FixedEmbeddings(Embeddings):
+    def __init__(self, vector):
+        self.vector = vector
+
+    def embed_documents(self, texts):
+        return [self.vector.tolist() for _ in texts]
+
+    def embed_query(self, text):
+        return self.vector.tolist()
+
+
+def _servicer(index_type, vectors, query):
+    # Small PQ codebooks keep training fast on the test corpus
+    params = {"pq_m": 4, "pq_bits": 4} if index_type == "pq" else {}
+    index = create_index(index_type, vectors, **params)
+    index.add(vectors)
+    documents = [
+        Document(
+            page_content=f"chunk {row}",
+            metadata={"source": "one.pdf" if row in SOURCE_ROWS else f"other{row % 50}.pdf"},
+        )
+        for row in range(N_VECTORS)
+    ]
+    filter_index = MetadataFilterIndex()
+    for row, document in enumerate(documents):
+        filter_index.add(row, document.metadata)
+    vectordb = FAISS(
+        embedding_function=FixedEmbeddings(query),
+        index=index,
+        docstore=InMemoryDocstore({str(row): document for row, document in enumerate(documents)}),
+        index_to_docstore_id={row: str(row) for row in range(N_VECTORS)},
+    )
+    return RAGServicer(None, FixedEmbeddings(query), vectordb, filter_index=filter_index)
+
+
+@pytest.mark.parametrize("index_type", ["ivf", "hnsw", "pq", "ivf_float16", "flat"])
+def test_one_source_filter_returns_every_match(index_type):
+    vectors = _corpus()
+    # A query far from the filtered chunks, so probing near it alone would miss them
+    query = vectors[0] + 0.01
+    servicer = _servicer(index_type, vectors, query)
+    documents = servicer.retrieve_batch(["question"], k=4, filter={"source": "one.pdf"})[0]
+    assert sorted(document.page_content for document in documents) == sorted(
+        f"chunk {row}" for row in SOURCE_ROWS
+    )
+
+
+@pytest.mark.parametrize("index_type", ["ivf", "hnsw"])
+def test_scaled_search_falls_back_to_exact_results(index_type):
+    vectors = _corpus()
+    index = create_index(index_type, vectors)
+    index.add(vectors)
+    ids = np.asarray(SOURCE_ROWS, dtype=np.int64)
+    _, indices = filtered_search(index, vectors[:2] + 0.01, 4, ids, exact_max_ids=0)
+    for row in indices:
+        assert sorted(row[row >= 0]) == SOURCE_ROWS
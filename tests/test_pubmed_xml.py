@@ -0,0 +1,60 @@
+from io import BytesIO
+
+import pytest
+from Bio import Entrez
+
+from aiweb_common.resource.PubMedCache import PubMedRecordCache
+from aiweb_common.resource.PubMedInterface import PubMedInterface
+
+MATHML_TITLE = (
+    'Rate <mml:math xmlns:mml="http://www.w3.org/1998/Math/MathML"><mml:mi>x</mml:mi></mml:math>'
+    " study"
+)
+
+
+def _article(pmid, title):
+    return (
+        '<PubmedArticle><MedlineCitation Status="MEDLINE" Owner="NLM">'
+        f'<PMID Version="1">{pmid}</PMID><Article PubModel="Print">'
+        f"<Journal><Title>Journal</Title></Journal><ArticleTitle>{title}</ArticleTitle>"
+        "</Article></MedlineCitation></PubmedArticle>"
+    )
+
+
+RESPONSE = (
+    '<?xml version="1.0" ?>\n'
+    '<!DOCTYPE PubmedArticleSet PUBLIC "-//NLM//DTD PubMedArticle, 1st January 2025//EN" '
+    '"https://dtd.nlm.nih.gov/ncbi/pubmed/out/pubmed_250101.dtd">\n'
+    f"<PubmedArticleSet>{_article('111', MATHML_TITLE)}{_article('222', 'Plain')}"
+    "</PubmedArticleSet>"
+).encode("utf-8")
+
+
+@pytest.fixture(autouse=True)
+def efetch(monkeypatch):
+    monkeypatch.setattr(Entrez, "efetch", lambda **kwargs: BytesIO(RESPONSE))
+
+
+def _pmids(articles):
+    return [str(article["MedlineCitation"]["PMID"]) for article in articles]
+
+
+def test_fetch_article_details_xml_with_mathml():
+    articles = PubMedInterface().fetch_article_details_xml(["222", "111"])
+    assert _pmids(articles) == ["222", "111"]
+
+
+def test_cached_article_details_xml_with_mathml(tmp_path):
+    pubmed = PubMedInterface(cache=PubMedRecordCache(tmp_path / "pubmed.db"))
+    assert _pmids(pubmed.fetch_article_details_xml(["222", "111"])) == ["222", "111"]
+    # The second call is answered from the cached article XML
+    assert _pmids(pubmed.fetch_article_details_xml(["222", "111"])) == ["222", "111"]
+
+
+def test_iterparse_cache_keeps_mathml_prefix(tmp_path):
+    pubmed = PubMedInterface(cache=PubMedRecordCache(tmp_path / "pubmed.db"))
+    assert [article["pmid"] for article in pubmed.iter_article_details_xml(["111", "222"])] == [
+        "111",
+        "222",
+    ]
+    assert _pmids(pubmed.fetch_article_details_xml(["222", "111"])) == ["222", "111"]